@@ -0,0 +1,733 @@
+import os
+import io
+import atexit
+import sys
+import json
+import time
+import types
+import asyncio
+import platform
+import argparse
+import shutil
+import tempfile
+import subprocess
+import multiprocessing as mp
+from datetime import datetime
+from types import SimpleNamespace
+import cv2
+import numpy as np
+import torch
+import torch.nn as nn
+from PIL import Image
+from config import Config
+from data_utils import extract_frames, choose_sampling_mode
+
+
+def find_ffmpeg():
+    """
+    查找 ffmpeg 可执行文件：优先使用 PATH 中的 ffmpeg，其次使用 imageio-ffmpeg 自带的二进制
+
+    Returns:
+        path: ffmpeg 路径，找不到时返回None
+    """
+    path = shutil.which('ffmpeg')
+    if path is not None:
+        return path
+    try:
+        import imageio_ffmpeg
+        return imageio_ffmpeg.get_ffmpeg_exe()
+    except (ImportError, RuntimeError):
+        return None
+
+
+def _synthetic_frames(num_frames, size):
+    width, height = size
+    rng = np.random.default_rng(0)
+    for i in range(num_frames):
+        frame = rng.integers(0, 40, (height, width, 3), dtype=np.uint8)
+        x = (i * 7) % max(width - 60, 1)
+        y = (i * 3) % max(height - 60, 1)
+        cv2.rectangle(frame, (x, y), (x + 60, y + 60), (0, 200, 255), -1)
+        yield frame
+
+
+def make_synthetic_video(path, num_frames=300, size=(640, 360), fps=25, codec='h264', key_interval=250):
+    """
+    生成合成测试视频 (移动的色块 + 噪声)，不依赖任何外部数据
+
+    Args:
+        path: 输出视频路径
+        num_frames: 视频帧数
+        size: 帧尺寸 (宽, 高)
+        fps: 帧率
+        codec: 'h264' 通过 ffmpeg/libx264 按 key_interval 固定GOP编码，模拟监控摄像头的长GOP码流；
+            'mp4v' 使用 cv2.VideoWriter (OpenCV自带的mp4v编码器忽略关键帧间隔，固定每12帧一个关键帧)
+        key_interval: 关键帧间隔 (GOP长度)，只对 h264 生效
+
+    Returns:
+        path: 输出视频路径
+    """
+    width, height = size
+    if codec == 'h264':
+        ffmpeg = find_ffmpeg()
+        if ffmpeg is None:
+            raise RuntimeError("h264 clips need ffmpeg (on PATH or via `pip install imageio-ffmpeg`)")
+        # 关闭场景切换检测，保证关键帧严格按 key_interval 出现
+        command = [ffmpeg, '-y', '-loglevel', 'error', '-f', 'rawvideo', '-pix_fmt', 'bgr24',
+                   '-s', f'{width}x{height}', '-r', str(fps), '-i', '-',
+                   '-c:v', 'libx264', '-preset', 'veryfast', '-pix_fmt', 'yuv420p',
+                   '-g', str(key_interval), '-keyint_min', str(key_interval), '-sc_threshold', '0',
+                   '-bf', '0', path]
+        process = subprocess.Popen(command, stdin=subprocess.PIPE)
+        for frame in _synthetic_frames(num_frames, size):
+            process.stdin.write(frame.tobytes())
+        process.stdin.close()
+        if process.wait() != 0:
+            raise RuntimeError(f"ffmpeg failed to encode {path}")
+        return path
+
+    writer = cv2.VideoWriter(path, cv2.CAP_FFMPEG, cv2.VideoWriter_fourcc(*codec), fps, size)
+    for frame in _synthetic_frames(num_frames, size):
+        writer.write(frame)
+    writer.release()
+    return path
+
+
+def time_call(fn, repeats=5, warmup=1):
+    """
+    多次调用并记录每次耗时
+
+    Args:
+        fn: 无参函数
+        repeats: 计时次数
+        warmup: 预热次数
+
+    Returns:
+        timings: 每次调用耗时(秒)列表
+    """
+    for _ in range(warmup):
+        fn()
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def summarize(timings):
+    """
+    计算耗时统计
+
+    Args:
+        timings: 耗时(秒)列表
+
+    Returns:
+        summary: 包含 p50/p95/p99 等统计量(毫秒)的字典
+    """
+    values = np.asarray(timings, dtype=np.float64) * 1000
+    return {
+        'n': int(values.size),
+        'mean_ms': float(values.mean()),
+        'min_ms': float(values.min()),
+        'p50_ms': float(np.percentile(values, 50)),
+        'p95_ms': float(np.percentile(values, 95)),
+        'p99_ms': float(np.percentile(values, 99)),
+        'max_ms': float(values.max())
+    }
+
+
+class StubBoxes:
+    """
+    模拟 ultralytics 检测结果中的 Boxes 对象
+    """
+
+    def __init__(self, xyxy, conf, cls):
+        self.xyxy = xyxy
+        self.conf = conf
+        self.cls = cls
+
+    def __len__(self):
+        return len(self.conf)
+
+
+class StubDetector:
+    """
+    离线替身检测器，调用方式与 ultralytics.YOLO 一致，每帧返回固定数量的随机检测框
+    """
+
+    def __init__(self, boxes_per_frame=12, seed=0):
+        self.boxes_per_frame = boxes_per_frame
+        self.generator = torch.Generator().manual_seed(seed)
+
+    def __call__(self, source, verbose=False):
+        n = self.boxes_per_frame
+        return [SimpleNamespace(boxes=StubBoxes(
+            xyxy=torch.rand(n, 4, generator=self.generator) * Config.FRAME_SIZE[0],
+            conf=torch.rand(n, generator=self.generator),
+            cls=torch.randint(0, 80, (n,), generator=self.generator).float()
+        )) for _ in range(len(source))]
+
+
+def make_clip_preprocess(resolution):
+    """
+    构建与 clip.load 返回的 preprocess 相同的预处理 (短边双三次缩放、中心裁剪、归一化)
+    """
+    from torchvision import transforms
+    from frame_utils import CLIP_MEAN, CLIP_STD
+
+    return transforms.Compose([
+        transforms.Resize(resolution, interpolation=transforms.InterpolationMode.BICUBIC),
+        transforms.CenterCrop(resolution),
+        lambda image: image.convert('RGB'),
+        transforms.ToTensor(),
+        transforms.Normalize(CLIP_MEAN, CLIP_STD)
+    ])
+
+
+def install_stub_clip(embed_dim=768, resolution=336):
+    """
+    注册一个替身 clip 模块，使 test.py 可以在没有CLIP权重的情况下离线运行
+    替身模型保留 encode_image/encode_text/logit_scale 接口，计算量远小于真实模型
+
+    Args:
+        embed_dim: 特征维度
+        resolution: 输入分辨率
+    """
+
+    class StubCLIP(nn.Module):
+        def __init__(self):
+            super().__init__()
+            self.visual = nn.Sequential(
+                nn.Conv2d(3, 16, kernel_size=16, stride=16),
+                nn.ReLU(),
+                nn.AdaptiveAvgPool2d(1),
+                nn.Flatten(),
+                nn.Linear(16, embed_dim)
+            )
+            self.visual.input_resolution = resolution
+            self.token_embedding = nn.Embedding(4096, embed_dim)
+            self.logit_scale = nn.Parameter(torch.tensor(np.log(100.0), dtype=torch.float32))
+
+        def encode_image(self, images):
+            return self.visual(images)
+
+        def encode_text(self, tokens):
+            return self.token_embedding(tokens).mean(dim=1)
+
+    preprocess = make_clip_preprocess(resolution)
+
+    def tokenize(texts):
+        tokens = [[sum(map(ord, word)) % 4096 for word in text.split()][:77] for text in texts]
+        result = torch.zeros(len(texts), 77, dtype=torch.long)
+        for i, row in enumerate(tokens):
+            result[i, :len(row)] = torch.tensor(row)
+        return result
+
+    module = types.ModuleType('clip')
+    module.load = lambda name, device='cpu', **kwargs: (StubCLIP().to(device).eval(), preprocess)
+    module.tokenize = tokenize
+    sys.modules['clip'] = module
+    # 替身模型的文本特征是随机的，写入临时目录，避免污染真实服务的提示词缓存
+    Config.CLIP_PROMPT_CACHE_DIR = tempfile.mkdtemp(prefix='clip_prompt_cache_')
+    atexit.register(shutil.rmtree, Config.CLIP_PROMPT_CACHE_DIR, ignore_errors=True)
+
+
+def bench_extract_frames(lengths=(160, 480, 1000, 3000), repeats=3, key_intervals=(50, 250)):
+    """
+    对比 seek 与 sequential 两种取帧方式在不同视频长度和GOP长度下的耗时，并估算两者的平衡点
+
+    seek 每次要从上一个关键帧解码约半个GOP，sequential 的代价与采样间隔成正比，
+    因此平衡点随GOP长度变化，可据此调整 Config.SEQUENTIAL_SAMPLING_MAX_STRIDE
+
+    Args:
+        lengths: 合成视频帧数列表
+        repeats: 每种方式的计时次数
+        key_intervals: 合成 h264 视频的关键帧间隔列表；没有 ffmpeg 时退回 mp4v (固定12帧GOP)
+
+    Returns:
+        results: 每个GOP长度、视频长度和取帧方式的耗时统计，以及每个GOP长度的平衡点
+    """
+    codec = 'h264'
+    if find_ffmpeg() is None:
+        print("extract_frames: ffmpeg not found, falling back to mp4v clips (12-frame GOP); "
+              "install ffmpeg or imageio-ffmpeg to measure long-GOP h264")
+        codec, key_intervals = 'mp4v', (12,)
+    results = {'codec': codec, 'max_stride': Config.SEQUENTIAL_SAMPLING_MAX_STRIDE, 'rows': [], 'break_even': {}}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for key_interval in key_intervals:
+            rows = []
+            for length in lengths:
+                video_path = make_synthetic_video(os.path.join(tmp_dir, f"synthetic_{key_interval}_{length}.mp4"),
+                                                  num_frames=length, codec=codec, key_interval=key_interval)
+                row = {'key_interval': key_interval, 'frames': length,
+                       'stride': length / Config.SAMPLE_FRAMES,
+                       'auto_mode': choose_sampling_mode(length, Config.SAMPLE_FRAMES)}
+                for mode in ('seek', 'sequential', 'auto'):
+                    timings = time_call(lambda: extract_frames(video_path, Config.SAMPLE_FRAMES, mode=mode), repeats)
+                    row[mode] = summarize(timings)
+                os.remove(video_path)
+                rows.append(row)
+                print(f"extract_frames gop {key_interval:>4} | {length:>6} frames (stride {row['stride']:6.1f}) | "
+                      f"seek {row['seek']['p50_ms']:8.1f} ms | sequential {row['sequential']['p50_ms']:8.1f} ms | "
+                      f"auto ({row['auto_mode']}) {row['auto']['p50_ms']:8.1f} ms")
+            # 平衡点：sequential 最后一次更快与 seek 第一次更快的采样间隔之间
+            faster_sequential = [row['stride'] for row in rows if row['sequential']['p50_ms'] <= row['seek']['p50_ms']]
+            faster_seek = [row['stride'] for row in rows if row['seek']['p50_ms'] < row['sequential']['p50_ms']]
+            bounds = [max(faster_sequential) if faster_sequential else None, min(faster_seek) if faster_seek else None]
+            results['break_even'][key_interval] = bounds
+            results['rows'].extend(rows)
+            print(f"extract_frames gop {key_interval:>4} | break-even stride between {bounds[0]} and {bounds[1]} "
+                  f"(SEQUENTIAL_SAMPLING_MAX_STRIDE = {Config.SEQUENTIAL_SAMPLING_MAX_STRIDE})")
+    return results
+
+
+def bench_yolo_features(detector='stub', repeats=50):
+    """
+    测量单个片段 (SAMPLE_FRAMES 帧) 的 extract_yolo_features 耗时
+
+    Args:
+        detector: 'stub' 使用离线替身检测器，'yolo' 使用 Config.YOLO_MODEL
+        repeats: 计时次数
+
+    Returns:
+        summary: 耗时统计
+    """
+    from dataset import extract_yolo_features
+
+    if detector == 'yolo':
+        from ultralytics import YOLO
+        yolo = YOLO(Config.YOLO_MODEL)
+    else:
+        yolo = StubDetector()
+
+    rng = np.random.default_rng(0)
+    frames = [rng.integers(0, 255, (Config.FRAME_SIZE[1], Config.FRAME_SIZE[0], 3), dtype=np.uint8)
+              for _ in range(Config.SAMPLE_FRAMES)]
+    out = np.zeros((Config.SAMPLE_FRAMES, Config.YOLO_FEATURE_SIZE), dtype=np.float32)
+    summary = summarize(time_call(lambda: extract_yolo_features(yolo, frames, out=out), repeats, warmup=3))
+    print(f"extract_yolo_features ({detector}) p50 {summary['p50_ms']:.2f} ms, p99 {summary['p99_ms']:.2f} ms")
+    return summary
+
+
+def bench_models(batch_sizes=(1, 8, 32), repeats=50):
+    """
+    测量各行为分类模型在不同批次大小下的前向传播耗时
+
+    Args:
+        batch_sizes: 批次大小列表
+        repeats: 计时次数
+
+    Returns:
+        results: {模型名称: {批次大小: 耗时统计}}
+    """
+    from models import MODEL_REGISTRY
+
+    torch.manual_seed(0)
+    results = {}
+    for model_type, model_class in MODEL_REGISTRY.items():
+        model = model_class().eval()
+        results[model_type] = {}
+        for batch_size in batch_sizes:
+            inputs = torch.randn(batch_size, Config.SAMPLE_FRAMES, Config.YOLO_FEATURE_SIZE)
+            with torch.no_grad():
+                summary = summarize(time_call(lambda: model(inputs), repeats, warmup=3))
+            results[model_type][batch_size] = summary
+            print(f"{model_type:>15} batch {batch_size:>3} | p50 {summary['p50_ms']:7.2f} ms | "
+                  f"p99 {summary['p99_ms']:7.2f} ms")
+    return results
+
+
+def bench_predict(requests=200, concurrency=(1, 8), real_clip=False):
+    """
+    测量 /predict 请求路径的耗时 (进程内ASGI调用，包含上传解析、解码、预处理、推理)
+
+    Args:
+        requests: 每个并发度下的请求数
+        concurrency: 并发度列表
+        real_clip: 是否使用真实CLIP模型，默认使用替身模型离线运行
+
+    Returns:
+        results: {并发度: 耗时统计和吞吐量}
+    """
+    import httpx
+
+    if not real_clip:
+        install_stub_clip()
+    import test as service
+    # ASGITransport 不会触发启动钩子，这里同步加载并预热模型
+    service.initialize()
+
+    buffer = io.BytesIO()
+    Image.fromarray(np.random.default_rng(0).integers(0, 255, (480, 640, 3), dtype=np.uint8)).save(buffer, 'JPEG')
+    image_bytes = buffer.getvalue()
+
+    async def run(level):
+        transport = httpx.ASGITransport(app=service.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://benchmark") as client:
+            timings = []
+
+            async def one():
+                start = time.perf_counter()
+                response = await client.post("/predict", files={"image": ("frame.jpg", image_bytes, "image/jpeg")})
+                response.raise_for_status()
+                timings.append(time.perf_counter() - start)
+
+            async def worker(count):
+                for _ in range(count):
+                    await one()
+
+            await one()  # 预热
+            timings.clear()
+            start = time.perf_counter()
+            await asyncio.gather(*[worker(requests // level) for _ in range(level)])
+            elapsed = time.perf_counter() - start
+            return {**summarize(timings), 'throughput_rps': len(timings) / elapsed}
+
+    results = {}
+    for level in concurrency:
+        results[level] = asyncio.run(run(level))
+        print(f"/predict concurrency {level:>3} | p50 {results[level]['p50_ms']:7.2f} ms | "
+              f"p99 {results[level]['p99_ms']:7.2f} ms | {results[level]['throughput_rps']:7.1f} req/s")
+    return results
+
+
+def bench_transport(frames=200, in_flight=(1, 4), real_clip=False):
+    """
+    比较逐帧 multipart POST /predict 与持久连接 /ws/predict 的单帧开销 (本机回环网络上的真实服务)
+
+    Args:
+        frames: 每种传输方式发送的帧数
+        in_flight: WebSocket 流水线同时在途的帧数列表
+        real_clip: 是否使用真实CLIP模型，默认使用替身模型离线运行
+
+    Returns:
+        results: {传输方式: 耗时统计和吞吐量}，overhead_ms 为 p50 减去进程内直接推理的 p50
+    """
+    import socket
+    import threading
+    import httpx
+    import uvicorn
+    from websockets.sync.client import connect
+
+    if not real_clip:
+        install_stub_clip()
+    import test as service
+    service.initialize()
+
+    buffer = io.BytesIO()
+    Image.fromarray(np.random.default_rng(0).integers(0, 255, (480, 640, 3), dtype=np.uint8)).save(buffer, 'JPEG')
+    image_bytes = buffer.getvalue()
+
+    async def run_inprocess():
+        timings = []
+        for _ in range(frames):
+            start = time.perf_counter()
+            await service.infer(image_bytes)
+            timings.append(time.perf_counter() - start)
+        return timings
+
+    results = {}
+    start = time.perf_counter()
+    timings = asyncio.run(run_inprocess())
+    results['inprocess'] = {**summarize(timings), 'throughput_fps': frames / (time.perf_counter() - start)}
+
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+    # 模型已在上面加载，关闭 lifespan 避免启动钩子重复加载；与 test.py 一致关闭WebSocket压缩
+    server = uvicorn.Server(uvicorn.Config(service.app, host='127.0.0.1', port=port, log_level='warning',
+                                           lifespan='off', ws_per_message_deflate=False))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.01)
+
+    def run_http(client_factory):
+        client = client_factory()
+        timings = []
+        start = time.perf_counter()
+        for _ in range(frames):
+            frame_start = time.perf_counter()
+            # 与 VideoStreamHandler.classifyFrame 相同，每帧一次 multipart 上传
+            if client is None:
+                response = httpx.post(f"http://127.0.0.1:{port}/predict",
+                                      files={"image": ("frame.jpg", image_bytes, "image/jpeg")})
+            else:
+                response = client.post("/predict", files={"image": ("frame.jpg", image_bytes, "image/jpeg")})
+            response.raise_for_status()
+            timings.append(time.perf_counter() - frame_start)
+        elapsed = time.perf_counter() - start
+        if client is not None:
+            client.close()
+        return {**summarize(timings), 'throughput_fps': frames / elapsed}
+
+    def run_websocket(depth):
+        sent_at = {}
+        timings = []
+        with connect(f"ws://127.0.0.1:{port}/ws/predict", max_size=None) as websocket:
+            start = time.perf_counter()
+            sent = 0
+            while len(timings) < frames:
+                while sent < frames and sent - len(timings) < depth:
+                    sent_at[sent] = time.perf_counter()
+                    websocket.send(service.FRAME_HEADER.pack(sent, 0, 0) + image_bytes)
+                    sent += 1
+                result = json.loads(websocket.recv())
+                if result['seq'] != len(timings):
+                    raise RuntimeError(f"expected seq {len(timings)}, got {result['seq']}")
+                timings.append(time.perf_counter() - sent_at[result['seq']])
+            elapsed = time.perf_counter() - start
+        return {**summarize(timings), 'throughput_fps': frames / elapsed}
+
+    try:
+        results['http_new_connection'] = run_http(lambda: None)
+        results['http_keep_alive'] = run_http(lambda: httpx.Client(base_url=f"http://127.0.0.1:{port}"))
+        for depth in in_flight:
+            results[f'websocket_in_flight_{depth}'] = run_websocket(depth)
+    finally:
+        server.should_exit = True
+        thread.join(timeout=10)
+
+    baseline = results['inprocess']['p50_ms']
+    for name, result in results.items():
+        result['overhead_ms'] = result['p50_ms'] - baseline
+        print(f"{name:<24} | p50 {result['p50_ms']:7.2f} ms | overhead {result['overhead_ms']:6.2f} ms | "
+              f"{result['throughput_fps']:7.1f} frames/s")
+    return results
+
+
+def bench_decode(batch_size=8, size=(1920, 1080), resolution=336, repeats=10):
+    """
+    对比两种 /predict 解码预处理方式处理一批JPEG的耗时：
+    baseline 为全分辨率解码后逐张 preprocess 再 stack，fast 为缩小倍率解码、逐张裁剪后整批归一化
+
+    Args:
+        batch_size: 批次大小
+        size: 源图尺寸 (宽, 高)
+        resolution: 模型输入分辨率
+        repeats: 计时次数
+
+    Returns:
+        results: 两种方式的耗时统计 (每批) 及与 preprocess 的误差
+    """
+    from frame_utils import ClipPreprocessor, open_image_bytes
+
+    rng = np.random.default_rng(0)
+    width, height = size
+    # 平滑的渐变加噪声，接近摄像头画面的JPEG压缩特性
+    gradient = np.linspace(0, 255, width, dtype=np.float32)[None, :, None] * np.ones((height, 1, 3), np.float32)
+    frame = np.clip(gradient + rng.normal(0, 8, (height, width, 3)), 0, 255).astype(np.uint8)
+    buffer = io.BytesIO()
+    Image.fromarray(frame).save(buffer, 'JPEG', quality=90)
+    payloads = [buffer.getvalue()] * batch_size
+
+    preprocess = make_clip_preprocess(resolution)
+    fast = ClipPreprocessor(resolution)
+
+    def baseline():
+        return torch.stack([preprocess(Image.open(io.BytesIO(data))) for data in payloads])
+
+    def fast_path():
+        return fast.to_tensor([fast.crop(open_image_bytes(data, resolution)) for data in payloads])
+
+    reference = baseline()
+    results = {
+        'batch_size': batch_size,
+        'source_size': list(size),
+        'baseline': summarize(time_call(baseline, repeats)),
+        'fast': summarize(time_call(fast_path, repeats)),
+        # 相同输入下批量预处理与 preprocess 的误差，以及缩小倍率解码带来的误差
+        'preprocess_max_error': fast.parity_error(preprocess, Image.open(io.BytesIO(payloads[0]))),
+        'draft_mean_abs_error': (fast_path() - reference).abs().mean().item()
+    }
+    print(f"decode+preprocess {width}x{height} x{batch_size} | baseline p50 {results['baseline']['p50_ms']:7.2f} ms | "
+          f"fast p50 {results['fast']['p50_ms']:7.2f} ms | parity {results['preprocess_max_error']:.2e} | "
+          f"draft error {results['draft_mean_abs_error']:.3f}")
+    return results
+
+
+def get_pss_mb(pid=None):
+    """
+    读取进程及其所有子进程的按比例分摊内存 (PSS) 之和 (仅Linux)
+
+    与直接累加RSS不同，fork出的工作进程之间共享的页只按比例计入一次
+
+    Args:
+        pid: 进程ID，默认当前进程
+
+    Returns:
+        pss_mb: 内存占用(MB)，无法读取时返回None
+    """
+    if not os.path.isdir('/proc'):
+        return None
+    total_kb = 0
+    pending = [pid or os.getpid()]
+    while pending:
+        current = pending.pop()
+        try:
+            with open(f'/proc/{current}/smaps_rollup') as f:
+                for line in f:
+                    if line.startswith('Pss:'):
+                        total_kb += int(line.split()[1])
+                        break
+            with open(f'/proc/{current}/task/{current}/children') as f:
+                pending.extend(int(child) for child in f.read().split())
+        except OSError:
+            continue
+    return total_kb / 1024
+
+
+def _measure_loader_startup(mode, video_paths, labels, detector, queue):
+    """
+    在独立进程中构建 get_data_loaders 同样的三个数据加载器，测量启动耗时和内存
+
+    mode='eager' 复现改动前的行为：每个数据集在 __init__ 中加载检测器并随数据集复制到工作进程，
+    工作进程不复用、不限制线程数；mode='lazy' 使用当前的 create_data_loader
+    """
+    import dataset as dataset_module
+    from torch.utils.data import DataLoader
+    from feature_cache import FeatureCache
+
+    if detector == 'stub':
+        dataset_module.YOLO = lambda path: StubDetector()
+
+    class EagerDetectorDataset(dataset_module.DangerousBehaviorDataset):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            self._yolo = dataset_module.YOLO(Config.YOLO_MODEL)
+
+        def __getstate__(self):
+            return self.__dict__.copy()
+
+    dataset_class = EagerDetectorDataset if mode == 'eager' else dataset_module.DangerousBehaviorDataset
+    with tempfile.TemporaryDirectory() as cache_dir:
+        start = time.perf_counter()
+        datasets = [dataset_class(video_paths, labels, dataset_module.get_frame_transform(), FeatureCache(cache_dir))
+                    for _ in range(3)]
+        init_s = time.perf_counter() - start
+
+        if mode == 'eager':
+            loaders = [DataLoader(d, batch_size=Config.BATCH_SIZE, shuffle=(i == 0), num_workers=Config.NUM_WORKERS)
+                       for i, d in enumerate(datasets)]
+        else:
+            loaders = [dataset_module.create_data_loader(d, shuffle=(i == 0)) for i, d in enumerate(datasets)]
+        iterators = [iter(loader) for loader in loaders]
+        for iterator in iterators:
+            next(iterator)
+        first_batch_s = time.perf_counter() - start
+        pss_mb = get_pss_mb()
+
+        # 第二个epoch：特征已写入缓存，只剩工作进程启动和读取缓存的开销
+        for iterator in iterators:
+            for _ in iterator:
+                pass
+        start = time.perf_counter()
+        next(iter(loaders[0]))
+        next_epoch_s = time.perf_counter() - start
+
+    queue.put({'init_s': init_s, 'first_batch_s': first_batch_s, 'pss_mb': pss_mb,
+               'next_epoch_first_batch_s': next_epoch_s})
+
+
+def bench_loader_startup(detector='stub', num_videos=16):
+    """
+    对比检测器在 __init__ 中加载 (eager) 与在工作进程中按需加载 (lazy) 时，
+    三个数据加载器的启动耗时和内存占用
+
+    Args:
+        detector: 'stub' 使用离线替身检测器，'yolo' 使用 Config.YOLO_MODEL
+        num_videos: 每个数据集的合成视频数量
+
+    Returns:
+        results: {mode: 启动耗时和内存}
+    """
+    results = {}
+    if 'fork' not in mp.get_all_start_methods():
+        # 替身检测器和 eager 数据集通过 fork 传给工作进程，与Linux上训练时的行为一致
+        print("data loaders benchmark requires the 'fork' start method, skipped")
+        return results
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        video_paths = [make_synthetic_video(os.path.join(tmp_dir, f"clip_{i}.mp4"), num_frames=64, codec="mp4v")
+                       for i in range(num_videos)]
+        labels = [i % Config.NUM_CLASSES for i in range(num_videos)]
+        # 每种方式在新的子进程中运行，互不影响内存统计
+        context = mp.get_context('fork')
+        for mode in ('eager', 'lazy'):
+            queue = context.Queue()
+            process = context.Process(target=_measure_loader_startup,
+                                      args=(mode, video_paths, labels, detector, queue))
+            process.start()
+            process.join()
+            if process.exitcode != 0:
+                raise RuntimeError(f"loader startup benchmark ({mode}) exited with code {process.exitcode}")
+            results[mode] = queue.get()
+            pss = results[mode]['pss_mb']
+            pss_text = f"{pss:8.1f} MB" if pss is not None else "n/a"
+            print(f"data loaders ({mode:>5}, {detector}) | init {results[mode]['init_s']:6.2f} s | "
+                  f"first batch {results[mode]['first_batch_s']:6.2f} s | "
+                  f"next epoch {results[mode]['next_epoch_first_batch_s']:6.2f} s | memory (PSS) {pss_text}")
+    return results
+
+
+def get_environment():
+    """
+    记录运行环境，便于在不同提交之间对比结果
+    """
+    try:
+        commit = subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=Config.PROJECT_ROOT,
+                                         stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'commit': commit,
+        'python': platform.python_version(),
+        'torch': torch.__version__,
+        'opencv': cv2.__version__,
+        'cpu_count': os.cpu_count(),
+        'torch_threads': torch.get_num_threads()
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="model/ 流水线性能基准测试")
+    parser.add_argument("suites", nargs="*", help="要运行的基准测试: frames, yolo, loaders, models, decode, predict, transport，默认全部运行")
+    parser.add_argument("--lengths", type=int, nargs="+", default=[160, 480, 1000, 3000], help="合成视频帧数")
+    parser.add_argument("--repeats", type=int, default=3, help="extract_frames 计时次数")
+    parser.add_argument("--key-intervals", type=int, nargs="+", default=[50, 250], help="extract_frames 合成h264视频的关键帧间隔 (GOP长度)")
+    parser.add_argument("--detector", choices=['stub', 'yolo'], default='stub', help="YOLO特征提取和数据加载器使用的检测器")
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 8, 32], help="模型前向传播的批次大小")
+    parser.add_argument("--requests", type=int, default=200, help="/predict 每个并发度的请求数")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8], help="/predict 并发度")
+    parser.add_argument("--real-clip", action="store_true", help="/predict 使用真实CLIP模型")
+    parser.add_argument("--frames", type=int, default=200, help="transport 每种传输方式发送的帧数")
+    parser.add_argument("--in-flight", type=int, nargs="+", default=[1, 4], help="transport 中WebSocket同时在途的帧数")
+    parser.add_argument("--output", default=None, help="结果JSON路径，默认保存到 Config.RESULT_DIR")
+    args = parser.parse_args()
+    all_suites = ['frames', 'yolo', 'loaders', 'models', 'decode', 'predict', 'transport']
+    suites = args.suites or all_suites
+    if any(suite not in all_suites for suite in suites):
+        parser.error(f"suites must be chosen from {all_suites}")
+
+    report = {'environment': get_environment()}
+    if 'frames' in suites:
+        report['extract_frames'] = bench_extract_frames(args.lengths, args.repeats, args.key_intervals)
+    if 'yolo' in suites:
+        report['extract_yolo_features'] = bench_yolo_features(args.detector)
+    if 'loaders' in suites:
+        report['loader_startup'] = bench_loader_startup(args.detector)
+    if 'models' in suites:
+        report['models'] = bench_models(args.batch_sizes)
+    if 'decode' in suites:
+        report['decode'] = bench_decode()
+    if 'predict' in suites:
+        report['predict'] = bench_predict(args.requests, args.concurrency, args.real_clip)
+    if 'transport' in suites:
+        report['transport'] = bench_transport(args.frames, args.in_flight, args.real_clip)
+
+    output = args.output or os.path.join(
+        Config.RESULT_DIR, f"benchmark_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+    print(f"Results saved to {output}")
@@ -9,6 +9,8 @@ class Config:
     MODEL_SAVE_DIR = os.path.join(PROJECT_ROOT, "saved_models")
     LOG_DIR = os.path.join(PROJECT_ROOT, "logs")
     RESULT_DIR = os.path.join(PROJECT_ROOT, "results")
+    FEATURE_CACHE_DIR = os.path.join(PROJECT_ROOT, "feature_cache")
+    PACKED_FEATURES_DIR = os.path.join(PROJECT_ROOT, "packed_features")
 
     # 创建必要的目录
     os.makedirs(DATA_ROOT, exist_ok=True)
@@ -24,10 +26,16 @@ class Config:
     # 视频帧配置
     SAMPLE_FRAMES = 16  # 每个视频片段采样的帧数
     FRAME_SIZE = (224, 224)  # 调整帧大小
+    # 采样间隔不超过该帧数时顺序读取，否则逐帧seek。两者的平衡点约为GOP长度的一半，
+    # 60 兼顾GOP 50~250的摄像头码流 (任一侧最多约慢2倍)；已知GOP时可改为 GOP/2，
+    # 或用 `python benchmark.py frames --key-intervals <GOP>` 实测平衡点
+    SEQUENTIAL_SAMPLING_MAX_STRIDE = 60
 
     # YOLOv8配置
     YOLO_MODEL = "yolov8n.pt"  # 可选: yolov8n.pt, yolov8s.pt, yolov8m.pt, yolov8l.pt, yolov8x.pt
     CONFIDENCE_THRESHOLD = 0.5  # 检测置信度阈值
+    USE_FEATURE_CACHE = True  # 是否使用磁盘特征缓存，避免每个epoch重复运行YOLO
+    USE_PACKED_FEATURES = False  # 训练时是否读取 packed_features.py 打包的单文件特征 (需先提取并打包)
 
     # 危险行为类别
     BEHAVIOR_CLASSES = {
@@ -45,10 +53,12 @@ class Config:
     NUM_CLASSES = len(BEHAVIOR_CLASSES)
 
     # LSTM模型配置
+    MODEL_TYPE = "YOLOLSTMv2"  # 可选: YOLOLSTM, YOLOLSTMv2, YOLOLSTMStream (单向、支持逐帧流式推理)
     YOLO_FEATURE_SIZE = 60  # YOLOv8特征向量大小 (10个框 × 6个特征)
     LSTM_HIDDEN_SIZE = 256
     LSTM_NUM_LAYERS = 2
     DROPOUT_RATE = 0.5
+    STREAM_ATTENTION_DECAY = 0.9  # 流式模型注意力的时间衰减系数，越小越关注最近的帧
 
     # 训练参数
     BATCH_SIZE = 8
@@ -56,7 +66,57 @@ class Config:
     LEARNING_RATE = 0.001
     WEIGHT_DECAY = 1e-5
     EARLY_STOPPING_PATIENCE = 5
+    USE_AMP = False  # 混合精度训练: CPU上使用bf16，CUDA上使用fp16 + GradScaler
+    USE_COMPILE = False  # 使用torch.compile编译模型，编译失败时回退到eager模式
 
     # 设备配置
     DEVICE = torch.device("cuda" if torch.cuda.is_available() else "cpu")
     NUM_WORKERS = 4  # DataLoader工作线程数
+    DATALOADER_WORKER_THREADS = 1  # 每个DataLoader工作进程的torch/OpenCV线程数
+
+    # CLIP推理服务配置
+    CLIP_MODEL = "ViT-L/14@336px"
+    CLIP_DOWNLOAD_ROOT = os.path.join(MODEL_SAVE_DIR, "clip")  # CLIP权重本地缓存目录，避免每次启动重新下载
+    CLIP_WEIGHTS_PATH = None  # 本地CLIP检查点路径 (预先转换好的权重)，设置后优先于 CLIP_MODEL
+    CLIP_WARMUP = True  # 启动时用空白图像预热，避免首个请求的延迟尖峰
+    CLIP_PROMPTS_FILE = os.path.join(PROJECT_ROOT, "prompts.json")  # 按 BEHAVIOR_CLASSES 类别分组的提示词
+    CLIP_PROMPT_CACHE_DIR = os.path.join(MODEL_SAVE_DIR, "prompt_cache")  # 类别原型和提示词特征的缓存目录
+    CLIP_NORMAL_LABELS = ("normal",)  # 表示正常画面的类别
+    CLIP_FAST_PREPROCESS = True  # 单张图像只缩放裁剪，归一化按批次完成 (启动时与 preprocess 比对，不一致则回退)
+    CLIP_PREPROCESS_TOLERANCE = 1e-4  # 批量预处理与 preprocess 允许的最大误差
+    CLIP_JPEG_DRAFT = True  # JPEG按1/2、1/4、1/8缩小解码 (不小于模型输入分辨率)，关闭则按原分辨率解码
+
+    # CLIP级联配置：小模型先推理，结果不确定或检测到异常时再交给 CLIP_MODEL 确认
+    CLIP_CASCADE_ENABLED = False
+    CLIP_FAST_MODEL = "ViT-B/32"
+    CLIP_FAST_WEIGHTS_PATH = None  # 快速模型的本地检查点路径
+    CLIP_CASCADE_MIN_CONFIDENCE = 0.5  # 快速模型top-1概率低于该值时升级
+    CLIP_CASCADE_MIN_MARGIN = 0.2  # top-1与top-2概率差低于该值时升级
+    CLIP_CASCADE_ESCALATE_ANOMALIES = True  # 快速模型预测为非正常标签时升级，由完整模型确认
+    CLIP_MAX_BATCH_SIZE = 8  # 动态批处理的最大批次大小
+    CLIP_MAX_WAIT_MS = 5  # 凑批最长等待时间(毫秒)
+    CLIP_INFERENCE_WORKERS = 2  # 推理线程数(解码/预处理与模型前向并行)
+    CLIP_INTRA_OP_THREADS = max(1, (os.cpu_count() or 1) // CLIP_INFERENCE_WORKERS)  # torch算子内线程数
+    CLIP_MAX_PENDING = 32  # 同时在途的最大请求数，超过则直接返回busy
+    WS_MAX_IN_FLIGHT = 4  # /ws/predict 每个连接同时推理的最大帧数
+    METRICS_ENABLED = True  # 是否记录各阶段耗时并通过 /metrics 导出
+    STREAM_TARGET_FPS = 5.0  # 每路视频流默认的目标分析帧率，落后时丢弃旧帧
+    STREAM_SESSION_TTL = 60  # 视频流会话空闲超时(秒)
+    SMOOTHING_ENABLED = True  # 对每路视频流的类别概率做时序平滑，只在状态变化时报警
+    SMOOTHING_METHOD = "ema"  # "ema" 指数滑动平均，"vote" 滑动窗口投票
+    SMOOTHING_ALPHA = 0.3  # ema 中新一帧的权重，越小越平滑
+    SMOOTHING_WINDOW = 8  # vote 的窗口帧数
+    SMOOTHING_ENTER_THRESHOLD = 0.6  # 平滑概率达到该值才切换到新类别
+    SMOOTHING_EXIT_THRESHOLD = 0.4  # 当前类别低于该值后，新类别达到该值即可切换
+    SMOOTHING_HEARTBEAT_INTERVAL = 30.0  # 只发送事件时，状态不变的心跳间隔(秒)，0表示不发送
+    DEDUP_ENABLED = True  # 是否对同一视频流的近似重复帧复用CLIP结果
+    DEDUP_HASH_SIZE = 8  # 感知哈希边长 (哈希位数为其平方)
+    DEDUP_MAX_DISTANCE = 4  # 视为近似重复的最大汉明距离，越大越容易命中
+    DEDUP_CACHE_SIZE = 32  # 每路视频流缓存的帧数
+
+    # 运动门控配置 (CLIP服务和实时YOLO特征提取共用)
+    MOTION_GATE_ENABLED = True  # 画面静止时跳过模型推理，复用上一次结果
+    MOTION_THUMBNAIL_SIZE = (64, 48)  # 差分使用的灰度缩略图尺寸
+    MOTION_PIXEL_THRESHOLD = 25  # 灰度差超过该值的像素视为变化
+    MOTION_AREA_THRESHOLD = 0.01  # 变化像素比例低于该值视为静止
+    MOTION_REFRESH_INTERVAL = 10.0  # 强制刷新间隔(秒)，保证静止画面也会定期重新分析
@@ -76,13 +76,65 @@ def split_dataset(video_paths, labels):
     }
 
 
-def extract_frames(video_path, num_frames=16):
+def choose_sampling_mode(total_frames, num_frames):
+    """
+    根据总帧数和采样步长选择取帧方式
+
+    H.264等长GOP编码下每次seek平均要从上一个关键帧重新解码约半个GOP，
+    采样间隔小于该代价时顺序读取一遍更快；间隔很大时seek更合算
+
+    Args:
+        total_frames: 视频总帧数
+        num_frames: 要提取的帧数量
+
+    Returns:
+        mode: 'sequential' 或 'seek'
+    """
+    stride = total_frames / max(num_frames, 1)
+    return 'sequential' if stride <= Config.SEQUENTIAL_SAMPLING_MAX_STRIDE else 'seek'
+
+
+def _read_frames_seek(cap, frame_indices):
+    """
+    逐帧seek读取指定帧
+    """
+    frames = []
+    for idx in frame_indices:
+        cap.set(cv2.CAP_PROP_POS_FRAMES, idx)
+        ret, frame = cap.read()
+        frames.append(frame if ret else None)
+    return frames
+
+
+def _read_frames_sequential(cap, frame_indices):
+    """
+    顺序遍历视频流一次，非目标帧只grab不解码，目标帧才retrieve
+    """
+    frames = []
+    position = 0
+    for idx in frame_indices:
+        # 跳过中间帧
+        ok = True
+        while position < idx and ok:
+            ok = cap.grab()
+            position += 1
+        if ok and cap.grab():
+            position += 1
+            ret, frame = cap.retrieve()
+            frames.append(frame if ret else None)
+        else:
+            frames.append(None)
+    return frames
+
+
+def extract_frames(video_path, num_frames=16, mode='auto'):
     """
     从视频中均匀提取指定数量的帧
 
     Args:
         video_path: 视频文件路径
         num_frames: 要提取的帧数量
+        mode: 取帧方式，'auto' 根据帧数和采样步长自动选择，'seek' 或 'sequential'
 
     Returns:
         frames: 提取的帧列表，格式为RGB的NumPy数组
@@ -98,11 +150,16 @@ def extract_frames(video_path, num_frames=16):
         # 均匀采样
         frame_indices = np.linspace(0, total_frames - 1, num_frames, dtype=int)
 
+    if mode == 'auto':
+        mode = choose_sampling_mode(total_frames, num_frames)
+    if mode == 'sequential':
+        raw_frames = _read_frames_sequential(cap, frame_indices)
+    else:
+        raw_frames = _read_frames_seek(cap, frame_indices)
+
     frames = []
-    for idx in frame_indices:
-        cap.set(cv2.CAP_PROP_POS_FRAMES, idx)
-        ret, frame = cap.read()
-        if ret:
+    for frame in raw_frames:
+        if frame is not None:
             # 转换为RGB格式
             frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
             # 调整大小
@@ -1,3 +1,4 @@
+import cv2
 import torch
 from torch.utils.data import Dataset, DataLoader
 from torchvision import transforms
@@ -5,6 +6,84 @@ from ultralytics import YOLO
 import numpy as np
 from config import Config
 from data_utils import extract_frames
+from feature_cache import FeatureCache
+from frame_utils import MotionGate
+
+
+MAX_DETECTIONS = 10  # 每帧保留的检测框数量
+DETECTION_DIM = 6  # 每个检测框的特征 [x1, y1, x2, y2, conf, class]
+
+
+def pack_detections(results, out=None):
+    """
+    将YOLOv8检测结果打包为定长特征 (每帧取前10个检测框，不足则填充0)
+
+    Args:
+        results: YOLOv8检测结果列表，每帧一个
+        out: 预分配的输出数组 [num_frames, feature_dim]，为None时新建
+
+    Returns:
+        features: 特征数组 [num_frames, feature_dim]，float32
+    """
+    if out is None:
+        out = np.zeros((len(results), MAX_DETECTIONS * DETECTION_DIM), dtype=np.float32)
+    else:
+        out[:] = 0
+    packed = out.reshape(len(results), MAX_DETECTIONS, DETECTION_DIM)
+
+    for i, result in enumerate(results):
+        boxes = result.boxes
+        n = min(MAX_DETECTIONS, len(boxes)) if boxes is not None else 0
+        if n == 0:
+            continue
+        # 拼接后一次性拷贝到CPU
+        detections = torch.cat([boxes.xyxy[:n], boxes.conf[:n, None], boxes.cls[:n, None]], dim=1)
+        packed[i, :n] = detections.cpu().numpy()
+
+    return out
+
+
+def scale_tensor_frame(frame):
+    """
+    按 Ultralytics 对单个张量输入的规则缩放帧：最大值超过1时视为0-255范围并除以255
+
+    Args:
+        frame: 变换后的帧张量 [C, H, W]
+
+    Returns:
+        frame: 缩放后的帧张量
+    """
+    eps = torch.finfo(frame.dtype).eps if frame.is_floating_point() else 0
+    if frame.max() > 1.0 + eps:
+        return frame.float() / 255.0
+    return frame
+
+
+def extract_yolo_features(yolo, frames, out=None):
+    """
+    对帧序列做一次批量YOLOv8检测并提取特征
+
+    Args:
+        yolo: YOLOv8模型
+        frames: 帧列表 (NumPy数组或变换后的张量)
+        out: 预分配的输出数组 [num_frames, feature_dim]
+
+    Returns:
+        features: 特征数组 [num_frames, feature_dim]，float32
+    """
+    if len(frames) == 0:
+        return np.zeros((0, MAX_DETECTIONS * DETECTION_DIM), dtype=np.float32)
+
+    # 所有帧合并为一个批次送入检测器
+    if isinstance(frames[0], torch.Tensor):
+        # Ultralytics 按整个输入张量的最大值决定是否除以255，逐帧处理时是按单帧判断的，
+        # 这里先按单帧规则缩放再合并，保证与逐帧检测的输入一致
+        source = torch.stack([scale_tensor_frame(frame) for frame in frames])
+    else:
+        source = list(frames)
+    results = yolo(source, verbose=False)
+
+    return pack_detections(results, out)
 
 
 class DangerousBehaviorDataset(Dataset):
@@ -12,7 +91,7 @@ class DangerousBehaviorDataset(Dataset):
     危险行为数据集类
     """
 
-    def __init__(self, video_paths, labels, transform=None):
+    def __init__(self, video_paths, labels, transform=None, feature_cache=None):
         """
         初始化数据集
 
@@ -20,13 +99,29 @@ class DangerousBehaviorDataset(Dataset):
             video_paths: 视频文件路径列表
             labels: 对应的标签列表
             transform: 图像变换
+            feature_cache: 特征缓存，默认根据 Config.USE_FEATURE_CACHE 创建
         """
         self.video_paths = video_paths
         self.labels = labels
         self.transform = transform
+        if feature_cache is None and Config.USE_FEATURE_CACHE:
+            feature_cache = FeatureCache()
+        self.feature_cache = feature_cache
 
-        # 初始化YOLOv8模型用于特征提取
-        self.yolo = YOLO(Config.YOLO_MODEL)
+        # YOLOv8模型在首次需要提取特征时才加载，每个DataLoader工作进程各自加载一份
+        self._yolo = None
+
+    @property
+    def yolo(self):
+        if self._yolo is None:
+            self._yolo = YOLO(Config.YOLO_MODEL)
+        return self._yolo
+
+    def __getstate__(self):
+        # 不把检测器序列化到工作进程
+        state = self.__dict__.copy()
+        state['_yolo'] = None
+        return state
 
     def __len__(self):
         """
@@ -44,33 +139,7 @@ class DangerousBehaviorDataset(Dataset):
         Returns:
             features: 特征张量 [num_frames, feature_dim]
         """
-        features = []
-        for frame in frames:
-            # 使用YOLOv8检测物体
-            results = self.yolo(frame, verbose=False)
-
-            # 提取检测到的对象特征
-            if len(results) > 0 and len(results[0].boxes) > 0:
-                # 获取检测框
-                boxes = results[0].boxes.xyxy.cpu().numpy()
-                # 获取置信度
-                confs = results[0].boxes.conf.cpu().numpy()
-                # 获取类别
-                cls = results[0].boxes.cls.cpu().numpy()
-
-                # 构建特征向量 (使用前10个检测框，如果不足则填充0)
-                feature = np.zeros((10, 6))  # [x1, y1, x2, y2, conf, class]
-                for i in range(min(10, len(boxes))):
-                    feature[i, :4] = boxes[i]
-                    feature[i, 4] = confs[i]
-                    feature[i, 5] = cls[i]
-
-                features.append(feature.flatten())
-            else:
-                # 如果没有检测到对象，则使用零向量
-                features.append(np.zeros(10 * 6))
-
-        return torch.tensor(features, dtype=torch.float32)
+        return torch.from_numpy(extract_yolo_features(self.yolo, frames))
 
     def __getitem__(self, idx):
         """
@@ -86,6 +155,12 @@ class DangerousBehaviorDataset(Dataset):
         video_path = self.video_paths[idx]
         label = self.labels[idx]
 
+        # 优先读取缓存的特征
+        if self.feature_cache is not None:
+            cached = self.feature_cache.load(video_path)
+            if cached is not None:
+                return torch.from_numpy(np.array(cached)), torch.tensor(label, dtype=torch.long)
+
         # 从视频中提取帧
         frames = extract_frames(video_path, Config.SAMPLE_FRAMES)
 
@@ -96,9 +171,60 @@ class DangerousBehaviorDataset(Dataset):
         # 提取YOLOv8特征
         features = self.extract_yolo_features(frames)
 
+        # 写入缓存
+        if self.feature_cache is not None:
+            self.feature_cache.save(video_path, features.numpy())
+
         return features, torch.tensor(label, dtype=torch.long)
 
 
+def dataset_worker_init_fn(worker_id):
+    """
+    DataLoader工作进程初始化：限制每个进程的线程数，避免多个工作进程争抢CPU核心
+
+    检测器不在这里加载，而是在该进程第一次遇到缓存未命中时加载，全部命中缓存时不会加载YOLO
+
+    Args:
+        worker_id: 工作进程编号
+    """
+    torch.set_num_threads(Config.DATALOADER_WORKER_THREADS)
+    cv2.setNumThreads(Config.DATALOADER_WORKER_THREADS)
+
+
+def create_data_loader(dataset, shuffle=False):
+    """
+    创建数据加载器，工作进程在各epoch之间复用
+
+    Args:
+        dataset: 数据集
+        shuffle: 是否打乱顺序
+
+    Returns:
+        data_loader: 数据加载器
+    """
+    return DataLoader(
+        dataset,
+        batch_size=Config.BATCH_SIZE,
+        shuffle=shuffle,
+        num_workers=Config.NUM_WORKERS,
+        worker_init_fn=dataset_worker_init_fn,
+        persistent_workers=Config.NUM_WORKERS > 0
+    )
+
+
+def get_frame_transform():
+    """
+    获取YOLO特征提取前的帧变换，训练与离线特征提取共用，保证缓存的特征一致
+
+    Returns:
+        transform: 帧变换
+    """
+    return transforms.Compose([
+        transforms.ToTensor(),
+        transforms.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225]),
+    ])
+
+
 def get_data_loaders(dataset_splits):
     """
     创建数据加载器
@@ -110,10 +236,7 @@ def get_data_loaders(dataset_splits):
         字典包含训练、验证和测试数据加载器
     """
     # 定义数据变换
-    transform = transforms.Compose([
-        transforms.ToTensor(),
-        transforms.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225]),
-    ])
+    transform = get_frame_transform()
 
     # 创建数据集
     train_dataset = DangerousBehaviorDataset(
@@ -135,26 +258,9 @@ def get_data_loaders(dataset_splits):
     )
 
     # 创建数据加载器
-    train_loader = DataLoader(
-        train_dataset,
-        batch_size=Config.BATCH_SIZE,
-        shuffle=True,
-        num_workers=Config.NUM_WORKERS
-    )
-
-    val_loader = DataLoader(
-        val_dataset,
-        batch_size=Config.BATCH_SIZE,
-        shuffle=False,
-        num_workers=Config.NUM_WORKERS
-    )
-
-    test_loader = DataLoader(
-        test_dataset,
-        batch_size=Config.BATCH_SIZE,
-        shuffle=False,
-        num_workers=Config.NUM_WORKERS
-    )
+    train_loader = create_data_loader(train_dataset, shuffle=True)
+    val_loader = create_data_loader(val_dataset)
+    test_loader = create_data_loader(test_dataset)
 
     return {
         'train': train_loader,
@@ -168,21 +274,32 @@ class RealTimeVideoDataset:
     实时视频数据处理类，用于推理阶段
     """
 
-    def __init__(self, transform=None):
+    def __init__(self, transform=None, motion_gate=None):
         """
         初始化实时视频处理器
 
         Args:
             transform: 图像变换
+            motion_gate: 运动门控，默认根据 Config.MOTION_GATE_ENABLED 创建
         """
         self.transform = transform
+        if motion_gate is None and Config.MOTION_GATE_ENABLED:
+            motion_gate = MotionGate(pixel_threshold=Config.MOTION_PIXEL_THRESHOLD,
+                                     area_threshold=Config.MOTION_AREA_THRESHOLD,
+                                     refresh_interval=Config.MOTION_REFRESH_INTERVAL,
+                                     thumbnail_size=Config.MOTION_THUMBNAIL_SIZE)
+        self.motion_gate = motion_gate
         self.yolo = YOLO(Config.YOLO_MODEL)
-        self.frame_buffer = []
         self.max_buffer_size = Config.SAMPLE_FRAMES
 
+        # 逐帧特征的环形缓冲区，每帧只在加入时检测一次
+        self.feature_buffer = np.zeros((self.max_buffer_size, Config.YOLO_FEATURE_SIZE), dtype=np.float32)
+        self.write_index = 0  # 下一帧写入位置，同时也是最旧一帧的位置
+        self.num_frames = 0
+
     def add_frame(self, frame):
         """
-        添加一帧到缓冲区
+        添加一帧到缓冲区，并立即提取该帧的YOLOv8特征
 
         Args:
             frame: 输入帧
@@ -190,52 +307,41 @@ class RealTimeVideoDataset:
         # 调整大小
         frame = cv2.resize(frame, Config.FRAME_SIZE)
 
-        # 应用变换（如果有）
-        if self.transform:
-            frame = self.transform(frame)
-
-        # 添加到缓冲区
-        self.frame_buffer.append(frame)
-
-        # 保持缓冲区大小不超过max_buffer_size
-        if len(self.frame_buffer) > self.max_buffer_size:
-            self.frame_buffer.pop(0)
+        # 画面静止时不运行YOLO，沿用上一帧的特征
+        should_run = self.motion_gate is None or self.motion_gate.check_frame(frame) or self.num_frames == 0
+        if not should_run:
+            self.feature_buffer[self.write_index] = self.feature_buffer[self.write_index - 1]
+        else:
+            # 应用变换（如果有）
+            if self.transform:
+                frame = self.transform(frame)
+
+            # 检测结果直接写入缓冲区中最旧一帧的位置
+            extract_yolo_features(self.yolo, [frame],
+                                  out=self.feature_buffer[self.write_index:self.write_index + 1])
+        self.write_index = (self.write_index + 1) % self.max_buffer_size
+        self.num_frames = min(self.num_frames + 1, self.max_buffer_size)
+
+    def reset(self):
+        """
+        清空缓冲区 (如切换视频源时)
+        """
+        self.write_index = 0
+        self.num_frames = 0
+        if self.motion_gate is not None:
+            self.motion_gate.reference = None
 
     def get_features(self):
         """
         从缓冲区中获取特征
 
         Returns:
-            features: YOLOv8特征
+            features: YOLOv8特征 [1, SAMPLE_FRAMES, feature_dim]，按时间先后排列
         """
         # 如果缓冲区不足，则返回None
-        if len(self.frame_buffer) < self.max_buffer_size:
+        if self.num_frames < self.max_buffer_size:
             return None
 
-        features = []
-        for frame in self.frame_buffer:
-            # 使用YOLOv8检测物体
-            results = self.yolo(frame, verbose=False)
-
-            # 提取检测到的对象特征
-            if len(results) > 0 and len(results[0].boxes) > 0:
-                # 获取检测框
-                boxes = results[0].boxes.xyxy.cpu().numpy()
-                # 获取置信度
-                confs = results[0].boxes.conf.cpu().numpy()
-                # 获取类别
-                cls = results[0].boxes.cls.cpu().numpy()
-
-                # 构建特征向量 (使用前10个检测框，如果不足则填充0)
-                feature = np.zeros((10, 6))  # [x1, y1, x2, y2, conf, class]
-                for i in range(min(10, len(boxes))):
-                    feature[i, :4] = boxes[i]
-                    feature[i, 4] = confs[i]
-                    feature[i, 5] = cls[i]
-
-                features.append(feature.flatten())
-            else:
-                # 如果没有检测到对象，则使用零向量
-                features.append(np.zeros(10 * 6))
-
-        return torch.tensor(features, dtype=torch.float32).unsqueeze(0)  # 添加批次维度
\ No newline at end of file
+        # 按时间顺序重排 (从最旧一帧开始)，只拷贝 [SAMPLE_FRAMES, feature_dim] 的小数组
+        features = np.roll(self.feature_buffer, -self.write_index, axis=0)
+        return torch.from_numpy(features).unsqueeze(0)  # 添加批次维度
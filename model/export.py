@@ -0,0 +1,123 @@
+import os
+import json
+import inspect
+import argparse
+import numpy as np
+import torch
+
+from config import Config
+from models import load_model
+from inference_runtime import ExportedModelRuntime
+
+
+def export_torchscript(model, path):
+    """
+    导出TorchScript模型，优先script，失败时回退到trace
+
+    Args:
+        model: eval模式的fp32模型
+        path: 输出路径 (.pt)
+    """
+    try:
+        scripted = torch.jit.script(model)
+    except Exception:
+        example = torch.randn(1, Config.SAMPLE_FRAMES, Config.YOLO_FEATURE_SIZE)
+        scripted = torch.jit.trace(model, example)
+    scripted.save(path)
+
+
+def export_onnx(model, path, opset_version=17):
+    """
+    导出ONNX模型，批次维度和序列长度维度均为动态
+
+    YOLOLSTMv2 的特征编码器按时间步做BatchNorm，实际序列长度仍需等于 Config.SAMPLE_FRAMES
+
+    Args:
+        model: eval模式的fp32模型
+        path: 输出路径 (.onnx)
+        opset_version: ONNX opset版本
+    """
+    example = torch.randn(2, Config.SAMPLE_FRAMES, Config.YOLO_FEATURE_SIZE)
+    kwargs = {}
+    # 新版本torch默认使用dynamo导出器，这里统一使用支持dynamic_axes的TorchScript导出器
+    if 'dynamo' in inspect.signature(torch.onnx.export).parameters:
+        kwargs['dynamo'] = False
+    torch.onnx.export(
+        model, (example,), path,
+        input_names=['features'],
+        output_names=['logits'],
+        dynamic_axes={'features': {0: 'batch_size', 1: 'seq_len'}, 'logits': {0: 'batch_size'}},
+        opset_version=opset_version,
+        **kwargs
+    )
+
+
+def write_metadata(path, model_type):
+    """
+    写入运行时所需的元数据，使运行时无需导入 config.py
+
+    Args:
+        path: 模型文件路径
+        model_type: 模型名称
+    """
+    metadata = {
+        'model_type': model_type,
+        'class_names': [Config.BEHAVIOR_CLASSES[i] for i in range(Config.NUM_CLASSES)],
+        'seq_len': Config.SAMPLE_FRAMES,
+        'feature_size': Config.YOLO_FEATURE_SIZE
+    }
+    with open(os.path.splitext(path)[0] + '.json', 'w', encoding='utf-8') as f:
+        json.dump(metadata, f, ensure_ascii=False, indent=2)
+
+
+def check_parity(runtime, model, batch_sizes=(1, 4, 16), atol=1e-4):
+    """
+    对比导出模型与eager PyTorch的输出
+
+    Args:
+        runtime: ExportedModelRuntime
+        model: eval模式的fp32模型
+        batch_sizes: 测试的批次大小
+        atol: 允许的最大绝对误差
+
+    Returns:
+        max_diff: 最大绝对误差
+    """
+    max_diff = 0.0
+    with torch.no_grad():
+        for batch_size in batch_sizes:
+            inputs = torch.randn(batch_size, Config.SAMPLE_FRAMES, Config.YOLO_FEATURE_SIZE)
+            expected = model(inputs).numpy()
+            actual = runtime.predict_logits(inputs)
+            max_diff = max(max_diff, float(np.abs(expected - actual).max()))
+    if max_diff > atol:
+        raise RuntimeError(f"{runtime.path}: max abs diff {max_diff:.2e} exceeds {atol:.0e}")
+    return max_diff
+
+
+def main():
+    parser = argparse.ArgumentParser(description="导出 YOLOLSTM/YOLOLSTMv2 为 TorchScript 和 ONNX")
+    parser.add_argument("--model-path", default=os.path.join(Config.MODEL_SAVE_DIR, 'best_model.pth'))
+    parser.add_argument("--model-type", default=Config.MODEL_TYPE)
+    parser.add_argument("--output-dir", default=Config.MODEL_SAVE_DIR)
+    parser.add_argument("--formats", nargs="+", default=['torchscript', 'onnx'], choices=['torchscript', 'onnx'])
+    args = parser.parse_args()
+
+    model = load_model(args.model_path, args.model_type, device='cpu')
+    base_name = os.path.splitext(os.path.basename(args.model_path))[0]
+
+    for export_format in args.formats:
+        if export_format == 'torchscript':
+            path = os.path.join(args.output_dir, base_name + '.pt')
+            export_torchscript(model, path)
+        else:
+            path = os.path.join(args.output_dir, base_name + '.onnx')
+            export_onnx(model, path)
+        write_metadata(path, args.model_type)
+
+        max_diff = check_parity(ExportedModelRuntime(path), model)
+        print(f"Exported {export_format} to {path} (max abs diff vs eager: {max_diff:.2e})")
+
+
+if __name__ == "__main__":
+    main()
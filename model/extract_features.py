@@ -0,0 +1,169 @@
+import os
+import json
+import time
+import argparse
+import multiprocessing as mp
+import cv2
+import torch
+from config import Config
+from data_utils import get_video_paths, extract_frames
+from feature_cache import FeatureCache
+
+MANIFEST_NAME = 'manifest.jsonl'
+
+# 每个工作进程独立持有的检测器、帧变换和特征缓存，由 init_worker 创建
+_worker_state = {}
+
+
+def init_worker(cache_dir, num_threads):
+    """
+    工作进程初始化：限制线程数并加载一个YOLOv8检测器
+
+    Args:
+        cache_dir: 特征缓存目录
+        num_threads: 每个工作进程的torch/OpenCV线程数
+    """
+    # 延迟导入，主进程无需加载检测器
+    from ultralytics import YOLO
+    from dataset import get_frame_transform
+
+    torch.set_num_threads(num_threads)
+    cv2.setNumThreads(num_threads)
+    _worker_state['yolo'] = YOLO(Config.YOLO_MODEL)
+    _worker_state['transform'] = get_frame_transform()
+    _worker_state['cache'] = FeatureCache(cache_dir)
+
+
+def process_video(video_path):
+    """
+    提取单个视频的YOLOv8特征并写入特征缓存 (在工作进程中执行)
+
+    Args:
+        video_path: 视频文件路径
+
+    Returns:
+        record: 清单记录
+    """
+    from dataset import extract_yolo_features
+
+    start = time.perf_counter()
+    record = {'path': video_path}
+    try:
+        frames = extract_frames(video_path, Config.SAMPLE_FRAMES)
+        if not frames:
+            raise ValueError("no frames decoded")
+        frames = [_worker_state['transform'](frame) for frame in frames]
+        features = extract_yolo_features(_worker_state['yolo'], frames)
+        _worker_state['cache'].save(video_path, features)
+        record.update(status='ok', key=FeatureCache.make_key(video_path), frames=len(frames))
+    except Exception as e:
+        record.update(status='failed', error=f"{type(e).__name__}: {e}")
+    record['seconds'] = time.perf_counter() - start
+    return record
+
+
+def load_manifest(manifest_path):
+    """
+    读取清单中已完成的视频
+
+    Args:
+        manifest_path: 清单文件路径
+
+    Returns:
+        completed: {视频路径: 缓存键}
+    """
+    completed = {}
+    if not os.path.exists(manifest_path):
+        return completed
+    with open(manifest_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # 中断时可能留下不完整的最后一行
+                continue
+            if record.get('status') == 'ok':
+                completed[record['path']] = record['key']
+    return completed
+
+
+def filter_pending(video_paths, completed, cache):
+    """
+    过滤出需要提取的视频：未完成、视频已修改或缓存文件丢失的都需要重新提取
+
+    Args:
+        video_paths: 视频文件路径列表
+        completed: load_manifest 返回的已完成记录
+        cache: 特征缓存
+
+    Returns:
+        pending: 待提取的视频路径列表
+    """
+    pending = []
+    for video_path in video_paths:
+        key = completed.get(video_path)
+        if key is not None and key == cache.make_key(video_path) and os.path.exists(cache.get_path(key)):
+            continue
+        pending.append(video_path)
+    return pending
+
+
+def format_duration(seconds):
+    """
+    将秒数格式化为 h:mm:ss
+    """
+    seconds = int(seconds)
+    return f"{seconds // 3600}:{seconds // 60 % 60:02d}:{seconds % 60:02d}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="多进程离线提取YOLOv8特征，支持断点续跑")
+    parser.add_argument("--data-root", default=Config.DATA_ROOT)
+    parser.add_argument("--cache-dir", default=Config.FEATURE_CACHE_DIR, help="特征缓存目录，训练时从这里读取")
+    parser.add_argument("--workers", type=int, default=max(1, (os.cpu_count() or 1) // 2), help="工作进程数")
+    parser.add_argument("--threads-per-worker", type=int, default=1, help="每个工作进程的torch/OpenCV线程数")
+    parser.add_argument("--limit", type=int, default=None, help="只处理前N个待提取视频")
+    args = parser.parse_args()
+
+    video_paths, labels = get_video_paths(args.data_root)
+    label_map = dict(zip(video_paths, labels))
+    cache = FeatureCache(args.cache_dir)
+    manifest_path = os.path.join(args.cache_dir, MANIFEST_NAME)
+
+    completed = load_manifest(manifest_path)
+    pending = filter_pending(video_paths, completed, cache)
+    print(f"Videos: {len(video_paths)} total, {len(video_paths) - len(pending)} done, {len(pending)} pending")
+    if args.limit is not None:
+        pending = pending[:args.limit]
+    if not pending:
+        return
+
+    processed = failed = 0
+    start = time.perf_counter()
+    # spawn 避免工作进程继承主进程的CUDA/OpenCV状态
+    context = mp.get_context('spawn')
+    with open(manifest_path, 'a', encoding='utf-8') as manifest, \
+            context.Pool(args.workers, initializer=init_worker,
+                         initargs=(args.cache_dir, args.threads_per_worker)) as pool:
+        for record in pool.imap_unordered(process_video, pending):
+            record['label'] = label_map[record['path']]
+            # 每完成一个视频立即写入清单，中断后从清单续跑
+            manifest.write(json.dumps(record, ensure_ascii=False) + '\n')
+            manifest.flush()
+
+            processed += 1
+            if record['status'] != 'ok':
+                failed += 1
+                print(f"\nFailed: {record['path']} ({record['error']})")
+            elapsed = time.perf_counter() - start
+            rate = processed / elapsed
+            eta = (len(pending) - processed) / rate
+            print(f"\r[{processed}/{len(pending)}] {rate:.2f} videos/s, "
+                  f"elapsed {format_duration(elapsed)}, ETA {format_duration(eta)}", end='', flush=True)
+
+    print(f"\nDone: {processed - failed} extracted, {failed} failed, "
+          f"{format_duration(time.perf_counter() - start)} total. Features saved to {args.cache_dir}")
+
+
+if __name__ == "__main__":
+    main()
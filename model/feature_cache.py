@@ -0,0 +1,88 @@
+import os
+import json
+import hashlib
+import numpy as np
+from config import Config
+
+
+class FeatureCache:
+    """
+    YOLO特征磁盘缓存
+
+    以视频路径、文件大小、修改时间及特征提取相关配置的哈希作为键，
+    每个视频片段的 [SAMPLE_FRAMES, YOLO_FEATURE_SIZE] 特征保存为一个 .npy 文件，
+    读取时使用内存映射
+    """
+
+    def __init__(self, cache_dir=Config.FEATURE_CACHE_DIR):
+        """
+        初始化特征缓存
+
+        Args:
+            cache_dir: 缓存目录
+        """
+        self.cache_dir = cache_dir
+        os.makedirs(cache_dir, exist_ok=True)
+
+    @staticmethod
+    def make_key(video_path):
+        """
+        计算视频特征的缓存键
+
+        Args:
+            video_path: 视频文件路径
+
+        Returns:
+            key: 十六进制哈希字符串
+        """
+        stat = os.stat(video_path)
+        payload = {
+            'path': os.path.abspath(video_path),
+            'size': stat.st_size,
+            'mtime_ns': stat.st_mtime_ns,
+            'yolo_model': Config.YOLO_MODEL,
+            'sample_frames': Config.SAMPLE_FRAMES,
+            'frame_size': list(Config.FRAME_SIZE),
+            'confidence_threshold': Config.CONFIDENCE_THRESHOLD
+        }
+        return hashlib.sha1(json.dumps(payload, sort_keys=True).encode('utf-8')).hexdigest()
+
+    def get_path(self, key):
+        """
+        获取缓存键对应的文件路径
+        """
+        return os.path.join(self.cache_dir, key[:2], key + '.npy')
+
+    def load(self, video_path):
+        """
+        读取缓存的特征
+
+        Args:
+            video_path: 视频文件路径
+
+        Returns:
+            features: 内存映射的特征数组，未命中时返回None
+        """
+        path = self.get_path(self.make_key(video_path))
+        if not os.path.exists(path):
+            return None
+        try:
+            return np.load(path, mmap_mode='r')
+        except (ValueError, OSError):
+            # 文件损坏时视为未命中，重新计算后覆盖
+            return None
+
+    def save(self, video_path, features):
+        """
+        写入特征，先写临时文件再原子替换，多个进程同时写入同一键也是安全的
+
+        Args:
+            video_path: 视频文件路径
+            features: 特征数组 [num_frames, feature_dim]
+        """
+        path = self.get_path(self.make_key(video_path))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            np.save(f, np.asarray(features, dtype=np.float32))
+        os.replace(tmp_path, path)
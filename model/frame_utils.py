@@ -0,0 +1,261 @@
+import io
+import time
+import threading
+import numpy as np
+import torch
+from PIL import Image
+
+# CLIP图像预处理使用的归一化参数
+CLIP_MEAN = (0.48145466, 0.4578275, 0.40821073)
+CLIP_STD = (0.26862954, 0.26130258, 0.27577711)
+
+
+def dhash(image, hash_size=8):
+    """
+    计算图像的差异哈希 (dHash)
+
+    图像缩小为 (hash_size + 1) x hash_size 的灰度图，比较相邻像素的明暗得到 hash_size^2 位的指纹，
+    对压缩噪声和轻微亮度变化不敏感，适合判断监控画面是否近似重复
+
+    Args:
+        image: PIL图像
+        hash_size: 哈希边长
+
+    Returns:
+        hash_value: 整数形式的哈希值
+    """
+    thumbnail = image.convert('L').resize((hash_size + 1, hash_size), Image.BILINEAR)
+    pixels = np.asarray(thumbnail, dtype=np.int16)
+    bits = (pixels[:, 1:] > pixels[:, :-1]).flatten()
+    return int.from_bytes(np.packbits(bits).tobytes(), 'big')
+
+
+def hamming_distance(a, b):
+    """
+    计算两个哈希值之间的汉明距离
+    """
+    return bin(a ^ b).count('1')
+
+
+def gray_thumbnail(frame, size=(64, 48)):
+    """
+    生成灰度缩略图，用于廉价的画面变化检测
+
+    Args:
+        frame: PIL图像或 [H, W, 3] 的uint8 NumPy数组
+        size: 缩略图尺寸 (宽, 高)
+
+    Returns:
+        thumbnail: [高, 宽] 的float32数组
+    """
+    if isinstance(frame, np.ndarray):
+        frame = Image.fromarray(frame)
+    # BOX采样对区域取平均，同时抑制传感器噪声
+    thumbnail = frame.convert('L').resize(size, Image.BOX)
+    return np.asarray(thumbnail, dtype=np.float32)
+
+
+class MotionGate:
+    """
+    运动门控
+
+    在运行CLIP/YOLO之前，将当前帧的灰度缩略图与上一次分析的帧做差分，
+    变化像素比例低于阈值时认为画面静止，可直接复用上一次的结果；
+    超过强制刷新间隔后无论是否有运动都重新分析一次
+    """
+
+    def __init__(self, pixel_threshold=25, area_threshold=0.01, refresh_interval=10.0, thumbnail_size=(64, 48)):
+        """
+        初始化运动门控
+
+        Args:
+            pixel_threshold: 灰度差超过该值的像素视为变化
+            area_threshold: 变化像素比例不低于该值时视为有运动
+            refresh_interval: 强制刷新间隔(秒)
+            thumbnail_size: 缩略图尺寸 (宽, 高)
+        """
+        self.pixel_threshold = pixel_threshold
+        self.area_threshold = area_threshold
+        self.refresh_interval = refresh_interval
+        self.thumbnail_size = thumbnail_size
+
+        self.reference = None  # 上一次分析的帧的缩略图
+        self.last_refresh = 0.0
+        self.last_result = None  # 上一次分析的结果 (及重新打分所需的图像特征等)，由调用方保存
+        self.motion_ratio = 0.0
+
+        # 统计信息
+        self.checked = 0
+        self.skipped = 0
+
+    def check(self, thumbnail, now=None):
+        """
+        判断当前帧是否需要重新分析
+
+        Args:
+            thumbnail: gray_thumbnail() 生成的缩略图
+            now: 当前时间(秒)，默认取 time.monotonic()
+
+        Returns:
+            reason: 需要运行模型的原因，'initial' (没有参考帧)、'motion' (有运动) 或 'refresh' (到达强制刷新间隔)；
+                画面静止时返回None
+        """
+        now = time.monotonic() if now is None else now
+        self.checked += 1
+
+        if self.reference is None or self.reference.shape != thumbnail.shape:
+            reason = 'initial'
+        else:
+            changed = np.abs(thumbnail - self.reference) > self.pixel_threshold
+            self.motion_ratio = float(changed.mean())
+            if self.motion_ratio >= self.area_threshold:
+                reason = 'motion'
+            elif now - self.last_refresh >= self.refresh_interval:
+                reason = 'refresh'
+            else:
+                reason = None
+
+        if reason is not None:
+            self.reference = thumbnail
+            self.last_refresh = now
+        else:
+            self.skipped += 1
+        return reason
+
+    def check_frame(self, frame, now=None):
+        """
+        对原始帧做运动检测
+
+        Args:
+            frame: PIL图像或 [H, W, 3] 的uint8 NumPy数组
+            now: 当前时间(秒)
+
+        Returns:
+            reason: 需要运行模型的原因，画面静止时返回None，见 check()
+        """
+        return self.check(gray_thumbnail(frame, self.thumbnail_size), now)
+
+    def stats(self):
+        return {
+            'checked': self.checked,
+            'skipped': self.skipped,
+            'skip_rate': self.skipped / self.checked if self.checked else 0.0,
+            'motion_ratio': self.motion_ratio
+        }
+
+
+def open_image_bytes(image_bytes, min_size=None, raw_size=None):
+    """
+    解码上传的图像
+
+    JPEG源图远大于 min_size 时按 1/2、1/4 或 1/8 缩小解码 (在DCT域完成，比全分辨率解码后再缩小快得多)，
+    解码结果的短边不小于 min_size
+
+    Args:
+        image_bytes: 图像文件字节，或 raw_size 指定尺寸的原始RGB数据
+        min_size: 后续预处理需要的最小边长，为None时按原始分辨率解码
+        raw_size: 原始RGB数据的 (宽, 高)，为None时按图像文件解码
+
+    Returns:
+        image: PIL图像
+    """
+    if raw_size is not None:
+        width, height = raw_size
+        if len(image_bytes) != width * height * 3:
+            raise ValueError(f"raw RGB payload must be {width}x{height}x3 = {width * height * 3} bytes, "
+                             f"got {len(image_bytes)}")
+        # 直接引用上传的字节，不拷贝
+        return Image.frombuffer('RGB', (width, height), image_bytes, 'raw', 'RGB', 0, 1)
+
+    image = Image.open(io.BytesIO(image_bytes))
+    if min_size is not None and image.format == 'JPEG':
+        image.draft('RGB', (min_size, min_size))
+    image.load()
+    return image
+
+
+class ClipPreprocessor:
+    """
+    CLIP图像预处理的批量实现，与 clip.load 返回的 preprocess 结果一致
+
+    单张图像只做缩放和中心裁剪 (保持uint8)，归一化在整批上一次完成，
+    并写入每个线程复用的预分配缓冲区
+    """
+
+    def __init__(self, resolution, mean=CLIP_MEAN, std=CLIP_STD):
+        """
+        初始化预处理
+
+        Args:
+            resolution: 模型输入分辨率
+            mean: 归一化均值
+            std: 归一化标准差
+        """
+        self.resolution = resolution
+        # ToTensor 的 /255 合并进归一化参数
+        self.mean = torch.tensor(mean).view(1, 3, 1, 1) * 255
+        self.std = torch.tensor(std).view(1, 3, 1, 1) * 255
+        self._local = threading.local()
+
+    def crop(self, image):
+        """
+        短边缩放到 resolution (双三次插值) 后中心裁剪
+
+        Args:
+            image: PIL图像
+
+        Returns:
+            crop: uint8数组 [resolution, resolution, 3]
+        """
+        n = self.resolution
+        width, height = image.size
+        if width <= height:
+            size = (n, int(n * height / width))
+        else:
+            size = (int(n * width / height), n)
+        if size != image.size:
+            image = image.resize(size, Image.BICUBIC)
+        left = int(round((size[0] - n) / 2.0))
+        top = int(round((size[1] - n) / 2.0))
+        image = image.crop((left, top, left + n, top + n))
+        if image.mode != 'RGB':
+            image = image.convert('RGB')
+        return np.asarray(image)
+
+    def to_tensor(self, crops):
+        """
+        将一批裁剪后的图像归一化为模型输入
+
+        返回的张量是当前线程缓冲区的视图，下一次调用前有效
+
+        Args:
+            crops: crop 返回的uint8数组列表
+
+        Returns:
+            batch: 归一化后的张量 [batch_size, 3, resolution, resolution]
+        """
+        batch_size = len(crops)
+        buffer = getattr(self._local, 'buffer', None)
+        if buffer is None or buffer.shape[0] < batch_size:
+            buffer = torch.empty(batch_size, 3, self.resolution, self.resolution)
+            self._local.buffer = buffer
+        batch = buffer[:batch_size]
+        batch.copy_(torch.from_numpy(np.stack(crops)).permute(0, 3, 1, 2))
+        return batch.sub_(self.mean).div_(self.std)
+
+    def parity_error(self, preprocess, image):
+        """
+        与参考预处理结果比较的最大绝对误差
+
+        Args:
+            preprocess: clip.load 返回的 preprocess
+            image: PIL图像
+
+        Returns:
+            error: 最大绝对误差
+        """
+        expected = preprocess(image)
+        actual = self.to_tensor([self.crop(image)])[0]
+        if expected.shape != actual.shape:
+            return float('inf')
+        return (expected - actual).abs().max().item()
@@ -0,0 +1,87 @@
+import os
+import json
+import numpy as np
+import torch
+
+
+class ExportedModelRuntime:
+    """
+    行为分类模型的轻量推理运行时
+
+    直接加载 export.py 导出的 TorchScript (.pt) 或 ONNX (.onnx) 计算图，
+    不依赖 models.py 和 config.py，服务进程冷启动更快、单次调用开销更低
+    """
+
+    def __init__(self, path, num_threads=None):
+        """
+        初始化运行时
+
+        Args:
+            path: 导出的模型文件路径
+            num_threads: 推理线程数，为None时使用默认值
+        """
+        self.path = path
+        self.backend = 'onnx' if path.endswith('.onnx') else 'torchscript'
+
+        # 导出时写入的元数据 (类别名、输入形状)
+        self.metadata = {}
+        metadata_path = os.path.splitext(path)[0] + '.json'
+        if os.path.exists(metadata_path):
+            with open(metadata_path, 'r', encoding='utf-8') as f:
+                self.metadata = json.load(f)
+        self.class_names = self.metadata.get('class_names')
+
+        if self.backend == 'onnx':
+            import onnxruntime as ort
+            options = ort.SessionOptions()
+            if num_threads:
+                options.intra_op_num_threads = num_threads
+            self.session = ort.InferenceSession(path, options, providers=['CPUExecutionProvider'])
+            self.input_name = self.session.get_inputs()[0].name
+        else:
+            if num_threads:
+                torch.set_num_threads(num_threads)
+            self.module = torch.jit.load(path, map_location='cpu').eval()
+
+    def predict_logits(self, features):
+        """
+        批量推理，返回原始输出
+
+        Args:
+            features: 输入特征 [batch_size, seq_len, feature_dim]，NumPy数组或张量
+
+        Returns:
+            logits: [batch_size, num_classes] 的NumPy数组
+        """
+        if isinstance(features, torch.Tensor):
+            features = features.detach().cpu().numpy()
+        features = np.ascontiguousarray(features, dtype=np.float32)
+
+        if self.backend == 'onnx':
+            return self.session.run(None, {self.input_name: features})[0]
+        with torch.inference_mode():
+            return self.module(torch.from_numpy(features)).numpy()
+
+    def predict(self, features):
+        """
+        批量推理，返回每个样本的类别和置信度
+
+        Args:
+            features: 输入特征 [batch_size, seq_len, feature_dim]
+
+        Returns:
+            predictions: 每个样本的 {'class_id', 'class_name', 'confidence'} 列表
+        """
+        logits = self.predict_logits(features)
+        logits = logits - logits.max(axis=1, keepdims=True)
+        probabilities = np.exp(logits)
+        probabilities /= probabilities.sum(axis=1, keepdims=True)
+
+        predictions = []
+        for class_id, probs in zip(probabilities.argmax(axis=1), probabilities):
+            predictions.append({
+                'class_id': int(class_id),
+                'class_name': self.class_names[class_id] if self.class_names else str(class_id),
+                'confidence': float(probs[class_id])
+            })
+        return predictions
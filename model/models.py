@@ -1,3 +1,4 @@
+import math
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
@@ -172,4 +173,195 @@ class YOLOLSTMv2(nn.Module):
         # 全连接层
         outputs = self.fc(pooled)
 
-        return outputs
\ No newline at end of file
+        return outputs
+
+
+class YOLOLSTMStream(nn.Module):
+    """
+    YOLOv8 + 单向LSTM 流式模型
+
+    因果结构，既可以像其它模型一样对整个片段做前向传播，
+    也可以通过 step() 逐帧更新：LSTM隐藏状态和注意力汇总跨调用保留，每个新帧只需一次循环计算
+    """
+
+    def __init__(self, input_size=Config.YOLO_FEATURE_SIZE, hidden_size=Config.LSTM_HIDDEN_SIZE,
+                 num_layers=Config.LSTM_NUM_LAYERS, num_classes=Config.NUM_CLASSES,
+                 attention_decay=Config.STREAM_ATTENTION_DECAY):
+        """
+        初始化模型
+
+        Args:
+            input_size: 输入特征大小
+            hidden_size: LSTM隐藏层大小
+            num_layers: LSTM层数
+            num_classes: 行为类别数
+            attention_decay: 注意力时间衰减系数，每过一帧旧帧的注意力权重乘以该系数
+        """
+        super(YOLOLSTMStream, self).__init__()
+        self.hidden_size = hidden_size
+        self.num_layers = num_layers
+        self.log_decay = math.log(attention_decay)
+
+        # 逐帧特征编码 (不依赖序列长度，可逐帧计算)
+        self.feature_encoder = nn.Sequential(
+            nn.Linear(input_size, input_size // 2),
+            nn.ReLU(),
+            nn.LayerNorm(input_size // 2),
+            nn.Linear(input_size // 2, input_size // 2),
+            nn.ReLU(),
+            nn.LayerNorm(input_size // 2)
+        )
+
+        # 单向LSTM层
+        self.lstm = nn.LSTM(
+            input_size // 2,
+            hidden_size,
+            num_layers,
+            batch_first=True,
+            dropout=Config.DROPOUT_RATE if num_layers > 1 else 0
+        )
+
+        # 注意力打分 (softmax在前向传播中按时间维度计算)
+        self.attention = nn.Sequential(
+            nn.Linear(hidden_size, hidden_size // 2),
+            nn.Tanh(),
+            nn.Linear(hidden_size // 2, 1)
+        )
+
+        # 全连接层
+        self.fc = nn.Sequential(
+            nn.Linear(hidden_size, hidden_size // 2),
+            nn.BatchNorm1d(hidden_size // 2),
+            nn.ReLU(),
+            nn.Dropout(Config.DROPOUT_RATE),
+            nn.Linear(hidden_size // 2, num_classes)
+        )
+
+    def forward(self, x):
+        """
+        前向传播
+
+        Args:
+            x: 输入特征 [batch_size, seq_len, input_size]
+
+        Returns:
+            outputs: 分类结果 [batch_size, num_classes]
+        """
+        seq_len = x.size(1)
+
+        # 特征编码和LSTM前向传播 (初始状态为0)
+        x = self.feature_encoder(x)
+        lstm_out, _ = self.lstm(x)  # [batch_size, seq_len, hidden_size]
+
+        # 带时间衰减的注意力，与逐帧累积的结果一致
+        scores = self.attention(lstm_out)  # [batch_size, seq_len, 1]
+        age = torch.arange(seq_len - 1, -1, -1, device=x.device, dtype=scores.dtype)
+        scores = scores + (age * self.log_decay).view(1, seq_len, 1)
+        attention_weights = torch.softmax(scores, dim=1)
+        context = torch.sum(attention_weights * lstm_out, dim=1)  # [batch_size, hidden_size]
+
+        # 全连接层
+        outputs = self.fc(context)
+
+        return outputs
+
+    def init_state(self, batch_size, device=None):
+        """
+        创建初始流式状态
+
+        Args:
+            batch_size: 批次大小 (同时处理的视频流数量)
+            device: 设备
+
+        Returns:
+            state: (h, c, score_max, weight_sum, context_sum)
+        """
+        h = torch.zeros(self.num_layers, batch_size, self.hidden_size, device=device)
+        c = torch.zeros(self.num_layers, batch_size, self.hidden_size, device=device)
+        score_max = torch.full((batch_size, 1), float('-inf'), device=device)
+        weight_sum = torch.zeros(batch_size, 1, device=device)
+        context_sum = torch.zeros(batch_size, self.hidden_size, device=device)
+        return h, c, score_max, weight_sum, context_sum
+
+    def step(self, frame_features, state=None):
+        """
+        流式推理：输入一个新帧，更新状态并输出当前分类结果
+
+        Args:
+            frame_features: 新帧特征 [batch_size, input_size]
+            state: 上一次调用返回的状态，为None时从零开始
+
+        Returns:
+            outputs: 分类结果 [batch_size, num_classes]
+            state: 更新后的状态
+        """
+        if state is None:
+            state = self.init_state(frame_features.size(0), frame_features.device)
+        h, c, score_max, weight_sum, context_sum = state
+
+        # 单步LSTM
+        x = self.feature_encoder(frame_features).unsqueeze(1)
+        lstm_out, (h, c) = self.lstm(x, (h, c))
+        lstm_out = lstm_out.squeeze(1)  # [batch_size, hidden_size]
+
+        # 在线softmax：旧帧分数整体衰减，再并入新帧，数值稳定
+        score = self.attention(lstm_out)  # [batch_size, 1]
+        prev_max = score_max + self.log_decay
+        new_max = torch.maximum(prev_max, score)
+        prev_scale = torch.exp(prev_max - new_max)
+        cur_weight = torch.exp(score - new_max)
+        weight_sum = weight_sum * prev_scale + cur_weight
+        context_sum = context_sum * prev_scale + cur_weight * lstm_out
+
+        outputs = self.fc(context_sum / weight_sum)
+
+        return outputs, (h, c, new_max, weight_sum, context_sum)
+
+
+MODEL_REGISTRY = {
+    'YOLOLSTM': YOLOLSTM,
+    'YOLOLSTMv2': YOLOLSTMv2,
+    'YOLOLSTMStream': YOLOLSTMStream
+}
+
+
+def build_model(model_type=Config.MODEL_TYPE, **kwargs):
+    """
+    根据模型名称创建模型
+
+    Args:
+        model_type: 模型名称，见 MODEL_REGISTRY
+        **kwargs: 传给模型构造函数的参数
+
+    Returns:
+        model: 模型实例
+    """
+    if model_type not in MODEL_REGISTRY:
+        raise ValueError(f"Unknown model type: {model_type}, available: {list(MODEL_REGISTRY)}")
+    return MODEL_REGISTRY[model_type](**kwargs)
+
+
+def load_model(path, model_type=Config.MODEL_TYPE, device=Config.DEVICE):
+    """
+    加载模型文件，自动识别 best_model.pth (state_dict)、final_model.pth (完整检查点)
+    和 quantize.py 生成的INT8量化模型
+
+    Args:
+        path: 模型文件路径
+        model_type: 模型名称 (量化模型使用文件中记录的名称)
+        device: 设备 (量化模型只能在CPU上运行)
+
+    Returns:
+        model: eval模式的模型
+    """
+    checkpoint = torch.load(path, map_location='cpu', weights_only=False)
+
+    # 量化模型
+    if 'format' in checkpoint:
+        from quantize import load_quantized_model
+        return load_quantized_model(checkpoint)
+
+    state_dict = checkpoint.get('model_state_dict', checkpoint)
+    model = build_model(model_type)
+    model.load_state_dict(state_dict)
+    return model.to(device).eval()
@@ -0,0 +1,221 @@
+import os
+import json
+import argparse
+import numpy as np
+import torch
+from config import Config
+from feature_cache import FeatureCache
+
+FEATURES_FILE = 'features.npy'
+LABELS_FILE = 'labels.npy'
+INDEX_FILE = 'index.json'
+SPLITS = ('train', 'val', 'test')
+
+
+def pack_features(dataset_splits, output_dir=Config.PACKED_FEATURES_DIR, feature_cache=None):
+    """
+    将特征缓存中各视频的特征打包为单个连续数组
+
+    输出三个文件：
+        features.npy: float16 [N, SAMPLE_FRAMES, YOLO_FEATURE_SIZE]，按 train/val/test 顺序连续存放
+        labels.npy: int64 [N]
+        index.json: 视频路径列表及各划分在数组中的 [start, end) 区间
+
+    Args:
+        dataset_splits: split_dataset 返回的划分字典
+        output_dir: 输出目录
+        feature_cache: 特征缓存，默认使用 Config.FEATURE_CACHE_DIR
+
+    Returns:
+        index: 索引字典
+    """
+    feature_cache = feature_cache or FeatureCache()
+    paths = [path for split in SPLITS for path in dataset_splits[split]['videos']]
+    labels = [label for split in SPLITS for label in dataset_splits[split]['labels']]
+
+    # 先检查全部缓存能否读取，缺失和损坏 (如写了一半的 .npy) 的文件一起报告，不在打包中途失败
+    missing = [path for path in paths if feature_cache.load(path) is None]
+    if missing:
+        raise FileNotFoundError(f"{len(missing)} videos have missing or unreadable cached features "
+                                f"(e.g. {missing[0]}), run extract_features.py first")
+
+    os.makedirs(output_dir, exist_ok=True)
+    shape = (len(paths), Config.SAMPLE_FRAMES, Config.YOLO_FEATURE_SIZE)
+    # 直接写入内存映射文件，打包过程中不需要把全部特征放进内存
+    features_path = os.path.join(output_dir, FEATURES_FILE)
+    features = np.lib.format.open_memmap(features_path + '.tmp', mode='w+', dtype=np.float16, shape=shape)
+    for i, path in enumerate(paths):
+        clip_features = feature_cache.load(path)
+        if clip_features is None:
+            raise FileNotFoundError(f"{path}: cached features became missing or unreadable while packing")
+        if clip_features.shape != shape[1:]:
+            raise ValueError(f"{path}: expected features of shape {shape[1:]}, got {clip_features.shape}")
+        features[i] = clip_features
+    features.flush()
+    del features
+    os.replace(features_path + '.tmp', features_path)
+    np.save(os.path.join(output_dir, LABELS_FILE), np.asarray(labels, dtype=np.int64))
+
+    splits = {}
+    start = 0
+    for split in SPLITS:
+        end = start + len(dataset_splits[split]['videos'])
+        splits[split] = [start, end]
+        start = end
+    index = {
+        'paths': paths,
+        'splits': splits,
+        'shape': list(shape),
+        'yolo_model': Config.YOLO_MODEL
+    }
+    with open(os.path.join(output_dir, INDEX_FILE), 'w', encoding='utf-8') as f:
+        json.dump(index, f, ensure_ascii=False)
+    return index
+
+
+def load_index(packed_dir=Config.PACKED_FEATURES_DIR):
+    """
+    读取打包特征的索引
+    """
+    with open(os.path.join(packed_dir, INDEX_FILE), 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def load_packed_splits(packed_dir=Config.PACKED_FEATURES_DIR):
+    """
+    从打包特征的索引恢复数据集划分，格式与 split_dataset 相同
+
+    Args:
+        packed_dir: 打包特征目录
+
+    Returns:
+        dataset_splits: 包含训练、验证和测试数据的字典
+    """
+    index = load_index(packed_dir)
+    labels = np.load(os.path.join(packed_dir, LABELS_FILE)).tolist()
+    return {split: {'videos': index['paths'][start:end], 'labels': labels[start:end]}
+            for split, (start, end) in index['splits'].items()}
+
+
+class PackedFeatureDataset:
+    """
+    打包特征数据集，按切片读取整批样本，无需逐样本 __getitem__ 和 collate
+
+    特征文件以内存映射方式打开，in_memory=True 时一次性读入内存 (float16，每个样本约2KB)
+    """
+
+    def __init__(self, packed_dir=Config.PACKED_FEATURES_DIR, split='train', in_memory=True):
+        """
+        初始化打包特征数据集
+
+        Args:
+            packed_dir: 打包特征目录
+            split: 数据集划分 ('train', 'val', 'test')
+            in_memory: 是否将该划分的特征读入内存
+        """
+        index = load_index(packed_dir)
+        start, end = index['splits'][split]
+        features = np.load(os.path.join(packed_dir, FEATURES_FILE), mmap_mode='r')[start:end]
+        self.features = np.ascontiguousarray(features) if in_memory else features
+        self.labels = torch.from_numpy(np.load(os.path.join(packed_dir, LABELS_FILE))[start:end])
+        self.video_paths = index['paths'][start:end]
+
+    def __len__(self):
+        return len(self.labels)
+
+    def get_batch(self, indices):
+        """
+        按索引读取一批样本
+
+        Args:
+            indices: 样本索引，切片或升序整数数组
+
+        Returns:
+            features: YOLOv8特征 [batch_size, SAMPLE_FRAMES, feature_dim]，float32
+            labels: 标签 [batch_size]
+        """
+        features = torch.from_numpy(np.asarray(self.features[indices], dtype=np.float32))
+        return features, self.labels[indices]
+
+    def __getitem__(self, idx):
+        features, label = self.get_batch(slice(idx, idx + 1))
+        return features[0], label[0]
+
+
+class PackedBatchLoader:
+    """
+    打包特征的批次迭代器，接口与 DataLoader 一致 (可迭代、len() 为批次数、.dataset 为数据集)
+    """
+
+    def __init__(self, dataset, batch_size=Config.BATCH_SIZE, shuffle=False, pin_memory=False):
+        """
+        初始化批次迭代器
+
+        Args:
+            dataset: PackedFeatureDataset
+            batch_size: 批次大小
+            shuffle: 每个epoch是否打乱顺序
+            pin_memory: 是否使用锁页内存，加快拷贝到GPU
+        """
+        self.dataset = dataset
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.pin_memory = pin_memory
+
+    def __len__(self):
+        return (len(self.dataset) + self.batch_size - 1) // self.batch_size
+
+    def __iter__(self):
+        num_samples = len(self.dataset)
+        order = torch.randperm(num_samples).numpy() if self.shuffle else None
+        for start in range(0, num_samples, self.batch_size):
+            end = min(start + self.batch_size, num_samples)
+            if order is None:
+                indices = slice(start, end)
+            else:
+                # 批内排序，使内存映射读取尽量顺序
+                indices = np.sort(order[start:end])
+            features, labels = self.dataset.get_batch(indices)
+            if self.pin_memory:
+                features, labels = features.pin_memory(), labels.pin_memory()
+            yield features, labels
+
+
+def get_packed_data_loaders(packed_dir=Config.PACKED_FEATURES_DIR):
+    """
+    创建打包特征的数据加载器
+
+    Args:
+        packed_dir: 打包特征目录
+
+    Returns:
+        字典包含训练、验证和测试数据加载器
+    """
+    pin_memory = torch.cuda.is_available()
+    return {
+        split: PackedBatchLoader(PackedFeatureDataset(packed_dir, split),
+                                 batch_size=Config.BATCH_SIZE,
+                                 shuffle=(split == 'train'),
+                                 pin_memory=pin_memory)
+        for split in SPLITS
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="将特征缓存打包为单文件训练数据集")
+    parser.add_argument("--data-root", default=Config.DATA_ROOT)
+    parser.add_argument("--cache-dir", default=Config.FEATURE_CACHE_DIR)
+    parser.add_argument("--output-dir", default=Config.PACKED_FEATURES_DIR)
+    args = parser.parse_args()
+
+    from data_utils import get_video_paths, split_dataset
+
+    video_paths, labels = get_video_paths(args.data_root)
+    index = pack_features(split_dataset(video_paths, labels), args.output_dir, FeatureCache(args.cache_dir))
+    size_mb = os.path.getsize(os.path.join(args.output_dir, FEATURES_FILE)) / 1024 / 1024
+    print(f"Packed {index['shape'][0]} clips ({size_mb:.1f} MB) to {args.output_dir}: "
+          + ", ".join(f"{split} {end - start}" for split, (start, end) in index['splits'].items()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,175 @@
+import os
+import time
+import argparse
+import numpy as np
+import torch
+import torch.nn as nn
+from torch.ao.quantization import quantize_dynamic
+from torch.nn.utils.fusion import fuse_conv_bn_eval, fuse_linear_bn_eval
+
+from config import Config
+from models import build_model, load_model
+
+QUANTIZED_FORMAT = 'int8_dynamic'
+
+
+def fold_batchnorm(model):
+    """
+    将紧跟在 Linear/Conv1d 之后的 BatchNorm1d 折叠进前一层的权重 (仅用于推理)
+
+    YOLOLSTMv2 特征编码器中的 BatchNorm1d 位于ReLU之后且按时间步归一化，无法折叠，保持不变
+
+    Args:
+        model: eval模式的模型，原地修改
+
+    Returns:
+        model: 折叠后的模型
+    """
+    model.eval()
+    for module in model.modules():
+        if not isinstance(module, nn.Sequential):
+            continue
+        for i in range(len(module) - 1):
+            layer, bn = module[i], module[i + 1]
+            if not isinstance(bn, nn.BatchNorm1d):
+                continue
+            if isinstance(layer, nn.Linear) and layer.out_features == bn.num_features:
+                module[i] = fuse_linear_bn_eval(layer, bn)
+                module[i + 1] = nn.Identity()
+            elif isinstance(layer, nn.Conv1d) and layer.out_channels == bn.num_features:
+                module[i] = fuse_conv_bn_eval(layer, bn)
+                module[i + 1] = nn.Identity()
+    return model
+
+
+def quantize_model(model):
+    """
+    折叠BatchNorm后对LSTM和Linear层做动态INT8量化
+
+    Args:
+        model: fp32模型
+
+    Returns:
+        model: 量化后的模型 (仅支持CPU推理)
+    """
+    model = fold_batchnorm(model.cpu().eval())
+    return quantize_dynamic(model, {nn.LSTM, nn.Linear}, dtype=torch.qint8)
+
+
+def save_quantized_model(model, path, model_type=Config.MODEL_TYPE):
+    """
+    保存量化模型
+
+    Args:
+        model: 量化后的模型
+        path: 保存路径
+        model_type: 模型名称
+    """
+    torch.save({
+        'format': QUANTIZED_FORMAT,
+        'model_type': model_type,
+        'state_dict': model.state_dict()
+    }, path)
+
+
+def load_quantized_model(checkpoint):
+    """
+    从保存的量化模型字典重建模型
+
+    Args:
+        checkpoint: save_quantized_model 保存的字典
+
+    Returns:
+        model: 量化后的模型
+    """
+    model = quantize_model(build_model(checkpoint['model_type']))
+    model.load_state_dict(checkpoint['state_dict'])
+    return model.eval()
+
+
+def measure_latency(model, batch_sizes=(1, 4, 8, 16, 32), repeats=20, warmup=3):
+    """
+    测量不同批次大小下的推理延迟
+
+    Args:
+        model: 模型
+        batch_sizes: 批次大小列表
+        repeats: 计时次数
+        warmup: 预热次数
+
+    Returns:
+        latencies: {batch_size: 每批次延迟中位数(毫秒)}
+    """
+    latencies = {}
+    with torch.no_grad():
+        for batch_size in batch_sizes:
+            inputs = torch.randn(batch_size, Config.SAMPLE_FRAMES, Config.YOLO_FEATURE_SIZE)
+            for _ in range(warmup):
+                model(inputs)
+            timings = []
+            for _ in range(repeats):
+                start = time.perf_counter()
+                model(inputs)
+                timings.append(time.perf_counter() - start)
+            latencies[batch_size] = float(np.median(timings)) * 1000
+    return latencies
+
+
+def evaluate(model, data_loader):
+    """
+    在数据集上计算预测结果
+
+    Args:
+        model: 模型
+        data_loader: 数据加载器
+
+    Returns:
+        labels: 真实标签
+        predictions: 预测标签
+    """
+    all_labels = []
+    all_predictions = []
+    with torch.no_grad():
+        for inputs, labels in data_loader:
+            outputs = model(inputs.cpu())
+            all_labels.extend(labels.numpy())
+            all_predictions.extend(outputs.argmax(dim=1).numpy())
+    return np.array(all_labels), np.array(all_predictions)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="YOLOLSTM/YOLOLSTMv2 动态INT8量化")
+    parser.add_argument("--model-path", default=os.path.join(Config.MODEL_SAVE_DIR, 'best_model.pth'))
+    parser.add_argument("--output", default=os.path.join(Config.MODEL_SAVE_DIR, 'best_model_int8.pth'))
+    parser.add_argument("--model-type", default=Config.MODEL_TYPE)
+    parser.add_argument("--skip-eval", action="store_true", help="跳过测试集精度对比")
+    args = parser.parse_args()
+
+    fp32_model = load_model(args.model_path, args.model_type, device='cpu')
+    int8_model = quantize_model(load_model(args.model_path, args.model_type, device='cpu'))
+    save_quantized_model(int8_model, args.output, args.model_type)
+    print(f"Quantized model saved to {args.output}")
+
+    # 测试集精度对比
+    if not args.skip_eval:
+        # 与训练使用同一条数据路径 (打包特征或逐视频数据集)
+        from train import load_data
+
+        test_loader = load_data()[1]['test']
+        y_true, fp32_pred = evaluate(fp32_model, test_loader)
+        _, int8_pred = evaluate(int8_model, test_loader)
+        print(f"Test accuracy: fp32 {np.mean(fp32_pred == y_true):.4f}, "
+              f"int8 {np.mean(int8_pred == y_true):.4f}, "
+              f"agreement {np.mean(fp32_pred == int8_pred):.4f}")
+
+    # 延迟对比
+    fp32_latency = measure_latency(fp32_model)
+    int8_latency = measure_latency(int8_model)
+    print(f"{'batch':>6} | {'fp32 ms':>9} | {'int8 ms':>9} | {'speedup':>7}")
+    for batch_size in fp32_latency:
+        print(f"{batch_size:>6} | {fp32_latency[batch_size]:9.2f} | {int8_latency[batch_size]:9.2f} | "
+              f"{fp32_latency[batch_size] / int8_latency[batch_size]:6.2f}x")
+
+
+if __name__ == "__main__":
+    main()
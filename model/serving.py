@@ -0,0 +1,774 @@
+import time
+import bisect
+import asyncio
+import functools
+import threading
+from collections import Counter, OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from frame_utils import hamming_distance
+
+
+class MicroBatcher:
+    """
+    动态微批处理队列
+
+    并发请求提交的单个样本在队列中最多等待 max_wait_ms 毫秒或凑满 max_batch_size 个，
+    合并为一个批次统一处理，再把结果逐个分发回等待的请求
+    """
+
+    def __init__(self, process_batch, max_batch_size=8, max_wait_ms=5.0):
+        """
+        初始化批处理队列
+
+        Args:
+            process_batch: 异步批处理函数，输入样本列表，返回等长的结果列表
+            max_batch_size: 最大批次大小
+            max_wait_ms: 凑批最长等待时间(毫秒)
+        """
+        self.process_batch = process_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self.queue = None
+        self._worker = None
+
+        # 统计信息
+        self.total_batches = 0
+        self.total_items = 0
+        self.last_batch_size = 0
+        self.batch_size_counts = Counter()
+
+    def start(self):
+        """
+        在当前事件循环中启动批处理协程
+        """
+        if self._worker is None or self._worker.done():
+            self.queue = asyncio.Queue()
+            self._worker = asyncio.ensure_future(self._run())
+
+    async def stop(self):
+        """
+        停止批处理协程，未处理的请求以异常结束
+        """
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+        while self.queue is not None and not self.queue.empty():
+            _, future = self.queue.get_nowait()
+            if not future.done():
+                future.set_exception(RuntimeError("batcher stopped"))
+
+    async def submit(self, item):
+        """
+        提交一个样本并等待其结果
+
+        Args:
+            item: 单个样本
+
+        Returns:
+            result: 该样本的处理结果
+        """
+        self.start()
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((item, future))
+        return await future
+
+    async def _collect(self):
+        """
+        收集一个批次的样本
+        """
+        loop = asyncio.get_running_loop()
+        batch = [await self.queue.get()]
+        deadline = loop.time() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            # 队列中已有的样本直接取出，不再等待
+            if not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+                continue
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self):
+        while True:
+            batch = await self._collect()
+            # 跳过已被取消的请求(如客户端断开)
+            batch = [(item, future) for item, future in batch if not future.done()]
+            if not batch:
+                continue
+
+            self.total_batches += 1
+            self.total_items += len(batch)
+            self.last_batch_size = len(batch)
+            self.batch_size_counts[len(batch)] += 1
+
+            try:
+                results = await self.process_batch([item for item, _ in batch])
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+
+            for (_, future), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
+
+    def stats(self):
+        """
+        获取队列统计信息，用于在吞吐量与尾延迟之间调参
+
+        Returns:
+            stats: 统计信息字典
+        """
+        return {
+            'queue_depth': self.queue.qsize() if self.queue is not None else 0,
+            'max_batch_size': self.max_batch_size,
+            'max_wait_ms': self.max_wait * 1000.0,
+            'total_batches': self.total_batches,
+            'total_items': self.total_items,
+            'last_batch_size': self.last_batch_size,
+            'mean_batch_size': self.total_items / self.total_batches if self.total_batches else 0.0,
+            'batch_size_counts': dict(sorted(self.batch_size_counts.items()))
+        }
+
+
+class ExecutorBusyError(RuntimeError):
+    """
+    推理执行器已饱和
+    """
+
+
+class BoundedExecutor:
+    """
+    有界推理执行器
+
+    阻塞的解码和模型前向在线程池中执行，不占用事件循环；
+    同时在途的请求数超过上限时直接拒绝，避免请求无限排队
+    """
+
+    def __init__(self, max_workers=2, max_pending=32):
+        """
+        初始化执行器
+
+        Args:
+            max_workers: 工作线程数
+            max_pending: 同时在途的最大请求数
+        """
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="inference")
+
+        # 以下计数只在事件循环线程中修改
+        self.in_flight = 0
+        self.rejected = 0
+
+    @contextmanager
+    def admit(self):
+        """
+        请求准入控制，饱和时抛出 ExecutorBusyError
+        """
+        if self.in_flight >= self.max_pending:
+            self.rejected += 1
+            raise ExecutorBusyError("inference executor is saturated")
+        self.in_flight += 1
+        try:
+            yield
+        finally:
+            self.in_flight -= 1
+
+    async def run(self, fn, *args, **kwargs):
+        """
+        在线程池中执行阻塞函数
+
+        Args:
+            fn: 阻塞函数
+            *args: 位置参数
+            **kwargs: 关键字参数
+
+        Returns:
+            result: 函数返回值
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, functools.partial(fn, *args, **kwargs))
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False)
+
+    def stats(self):
+        """
+        获取执行器统计信息
+
+        Returns:
+            stats: 统计信息字典
+        """
+        return {
+            'workers': self.max_workers,
+            'in_flight': self.in_flight,
+            'max_pending': self.max_pending,
+            'rejected': self.rejected
+        }
+
+
+class TemporalSmoother:
+    """
+    单路视频流的时序平滑与迟滞状态机
+
+    对每帧的类别概率做指数滑动平均 (ema) 或滑动窗口投票 (vote)，平滑后的概率达到 enter_threshold
+    才切换到新类别；当前类别低于 exit_threshold 后，新类别达到 exit_threshold 即可切换。
+    单帧噪声不会改变状态，下游只需在状态变化 (change) 和周期性心跳 (heartbeat) 时接收事件
+    """
+
+    def __init__(self, method='ema', alpha=0.3, window=8, enter_threshold=0.6, exit_threshold=0.4,
+                 heartbeat_interval=30.0):
+        """
+        初始化平滑器
+
+        Args:
+            method: 'ema' 对概率做指数滑动平均，'vote' 对最近 window 帧的top-1类别投票
+            alpha: ema 中新一帧的权重
+            window: vote 的窗口帧数
+            enter_threshold: 切换到新类别所需的平滑概率
+            exit_threshold: 当前类别平滑概率低于该值时允许以较低的概率切换
+            heartbeat_interval: 状态不变时发送心跳的间隔(秒)，0表示不发送
+        """
+        if method not in ('ema', 'vote'):
+            raise ValueError(f"unknown smoothing method: {method}")
+        if exit_threshold > enter_threshold:
+            raise ValueError("exit_threshold must not exceed enter_threshold")
+        self.method = method
+        self.alpha = alpha
+        self.enter_threshold = enter_threshold
+        self.exit_threshold = exit_threshold
+        self.heartbeat_interval = heartbeat_interval
+        self.votes = deque(maxlen=window)
+        self.probs = None
+        self.state = None
+        self.previous = None
+        self.state_since = None
+        self.last_emit = None
+
+        # 统计信息
+        self.frames = 0
+        self.transitions = 0
+        self.heartbeats = 0
+
+    def _smooth(self, scores):
+        if self.probs is not None and self.probs.keys() != scores.keys():
+            # 类别集合变化 (标签热更新) 后重新开始平滑
+            self.probs = None
+            self.votes.clear()
+            if self.state not in scores:
+                self.state = None
+
+        if self.method == 'vote':
+            self.votes.append(max(scores, key=scores.get))
+            counts = Counter(self.votes)
+            self.probs = {label: counts[label] / len(self.votes) for label in scores}
+        elif self.probs is None:
+            self.probs = dict(scores)
+        else:
+            self.probs = {label: (1 - self.alpha) * self.probs[label] + self.alpha * prob
+                          for label, prob in scores.items()}
+
+    def update(self, scores, now):
+        """
+        加入一帧的类别概率并更新状态
+
+        Args:
+            scores: {类别名称: 概率}
+            now: 当前时间(秒)
+
+        Returns:
+            event: 'change' (状态变化)、'heartbeat' (状态不变但到达心跳间隔) 或 None (无需发送)
+        """
+        self.frames += 1
+        self._smooth(scores)
+        candidate = max(self.probs, key=self.probs.get)
+        prob = self.probs[candidate]
+
+        changed = False
+        if self.state is None:
+            changed = True
+        elif candidate != self.state:
+            changed = prob >= self.enter_threshold or \
+                (self.probs[self.state] < self.exit_threshold and prob >= self.exit_threshold)
+
+        if changed:
+            self.previous = self.state
+            self.state = candidate
+            self.state_since = now
+            self.transitions += 1
+            event = 'change'
+        elif self.heartbeat_interval and now - self.last_emit >= self.heartbeat_interval:
+            self.heartbeats += 1
+            event = 'heartbeat'
+        else:
+            return None
+        self.last_emit = now
+        return event
+
+    def snapshot(self, now):
+        """
+        获取当前的平滑状态
+
+        Args:
+            now: 当前时间(秒)
+
+        Returns:
+            state: 平滑后的类别、概率、上一状态、持续时间(秒)及各类别的平滑概率
+        """
+        return {
+            'label': self.state,
+            'confidence': self.probs[self.state] if self.state is not None else None,
+            'previous': self.previous,
+            'duration': now - self.state_since if self.state_since is not None else 0.0,
+            'scores': dict(self.probs) if self.probs is not None else {}
+        }
+
+    def stats(self):
+        return {
+            'state': self.state,
+            'frames': self.frames,
+            'transitions': self.transitions,
+            'heartbeats': self.heartbeats
+        }
+
+
+class StreamSession:
+    """
+    单路视频流的推理会话状态
+    """
+
+    def __init__(self, stream_id, target_fps, smoother=None):
+        self.stream_id = stream_id
+        self.smoother = smoother  # 时序平滑器，为None时不做平滑
+        self.min_interval = 1.0 / target_fps if target_fps > 0 else 0.0
+        self.busy = False  # 是否有帧正在推理 (或已被唤醒即将推理)
+        self.waiter = None  # 等待推理的最新一帧
+        self.next_slot = 0.0  # 下一帧最早可开始推理的时间
+        self.last_active = 0.0
+        self.last_result = None
+
+        # 统计信息
+        self.received = 0
+        self.processed = 0
+        self.dropped = 0
+        self.last_processed_at = None
+        self.mean_interval = None  # 推理间隔的指数滑动平均
+
+    def set_target_fps(self, target_fps):
+        self.min_interval = 1.0 / target_fps if target_fps > 0 else 0.0
+
+    def record_processed(self, now, result):
+        self.processed += 1
+        self.last_result = result
+        if self.last_processed_at is not None:
+            interval = now - self.last_processed_at
+            self.mean_interval = interval if self.mean_interval is None else \
+                0.9 * self.mean_interval + 0.1 * interval
+        self.last_processed_at = now
+
+    def stats(self):
+        return {
+            'target_fps': 1.0 / self.min_interval if self.min_interval > 0 else None,
+            'effective_fps': 1.0 / self.mean_interval if self.mean_interval else 0.0,
+            'received': self.received,
+            'processed': self.processed,
+            'dropped': self.dropped,
+            'smoothing': self.smoother.stats() if self.smoother is not None else None
+        }
+
+
+class StreamSessionManager:
+    """
+    多路视频流会话管理
+
+    每路视频流最多一帧在推理、一帧在等待，新帧到达时替换等待中的旧帧 (旧帧被丢弃)，
+    并按目标分析帧率限速：未到限速时间的帧立即丢弃，不排队等待。
+    因此任何一路流都不会积压，也不会挤占其它流的推理资源
+    """
+
+    _GO = object()
+    _DROPPED = object()
+
+    def __init__(self, target_fps=5.0, session_ttl=60.0, smoother_factory=None):
+        """
+        初始化会话管理器
+
+        Args:
+            target_fps: 每路视频流默认的目标分析帧率，0表示不限速
+            session_ttl: 会话空闲超过该时间(秒)后被清理
+            smoother_factory: 为每个新会话创建时序平滑器的函数，为None时不做平滑
+        """
+        self.target_fps = target_fps
+        self.session_ttl = session_ttl
+        self.smoother_factory = smoother_factory
+        self.sessions = {}
+
+    def get_session(self, stream_id, target_fps=None):
+        """
+        获取或创建会话，同时清理过期会话
+
+        Args:
+            stream_id: 视频流ID
+            target_fps: 目标分析帧率，为None时保持不变
+
+        Returns:
+            session: 会话
+        """
+        now = asyncio.get_running_loop().time()
+        expired = [sid for sid, s in self.sessions.items()
+                   if now - s.last_active > self.session_ttl and not s.busy and s.waiter is None]
+        for sid in expired:
+            del self.sessions[sid]
+
+        session = self.sessions.get(stream_id)
+        if session is None:
+            smoother = self.smoother_factory() if self.smoother_factory is not None else None
+            session = StreamSession(stream_id, self.target_fps, smoother)
+            self.sessions[stream_id] = session
+        if target_fps is not None:
+            session.set_target_fps(target_fps)
+        session.last_active = now
+        return session
+
+    async def submit(self, stream_id, item, process, target_fps=None):
+        """
+        提交一帧，按会话的限速和丢帧策略执行
+
+        Args:
+            stream_id: 视频流ID
+            item: 帧数据
+            process: 异步处理函数
+            target_fps: 目标分析帧率，为None时使用会话当前值
+
+        Returns:
+            session: 该视频流的会话 (处理期间可能已被清理出 sessions，调用方应使用该对象而不是重新查找)
+            result: 处理结果，该帧被丢弃时返回None
+        """
+        loop = asyncio.get_running_loop()
+        session = self.get_session(stream_id, target_fps)
+        session.received += 1
+
+        # 新帧替换等待中的旧帧
+        if session.waiter is not None and not session.waiter.done():
+            session.waiter.set_result(self._DROPPED)
+            session.dropped += 1
+        session.waiter = None
+
+        if not session.busy and loop.time() < session.next_slot:
+            # 未到限速时间且没有帧在推理时立即丢弃，不排队等待，客户端不会因此积压
+            session.dropped += 1
+            return session, None
+
+        if session.busy:
+            # 只在有帧正在推理时等待，推理完成后由 _wake 唤醒或丢弃
+            waiter = loop.create_future()
+            session.waiter = waiter
+            try:
+                outcome = await waiter
+            except asyncio.CancelledError:
+                # 已被唤醒但请求被取消时释放会话
+                if waiter.done() and not waiter.cancelled() and waiter.result() is self._GO:
+                    session.busy = False
+                    self._wake(session)
+                raise
+            if outcome is self._DROPPED:
+                return session, None
+        else:
+            session.busy = True
+
+        try:
+            session.next_slot = loop.time() + session.min_interval
+            result = await process(item)
+            session.record_processed(loop.time(), result)
+            return session, result
+        finally:
+            session.busy = False
+            self._wake(session)
+
+    def _wake(self, session):
+        """
+        会话空闲后唤醒等待中的帧，未到限速时间则丢弃该帧
+        """
+        if session.busy or session.waiter is None or session.waiter.done():
+            return
+        if asyncio.get_running_loop().time() < session.next_slot:
+            session.waiter.set_result(self._DROPPED)
+            session.waiter = None
+            session.dropped += 1
+            return
+        # 唤醒前先占用会话，避免与新到达的帧同时推理
+        session.busy = True
+        session.waiter.set_result(self._GO)
+        session.waiter = None
+
+    def stats(self):
+        """
+        获取各会话的统计信息
+
+        Returns:
+            stats: {stream_id: 统计信息字典}
+        """
+        return {stream_id: session.stats() for stream_id, session in self.sessions.items()}
+
+
+class NearDuplicateCache:
+    """
+    近似重复帧缓存
+
+    按视频流分别维护一个有界LRU，键为帧的感知哈希。新帧与缓存中某一帧的汉明距离
+    不超过 max_distance 时视为命中，直接复用缓存的图像特征和预测结果
+    """
+
+    def __init__(self, max_distance=4, max_entries_per_stream=32, max_streams=256):
+        """
+        初始化缓存
+
+        Args:
+            max_distance: 视为近似重复的最大汉明距离
+            max_entries_per_stream: 每路视频流最多缓存的帧数
+            max_streams: 最多缓存的视频流数量，超过时淘汰最久未使用的流
+        """
+        self.max_distance = max_distance
+        self.max_entries_per_stream = max_entries_per_stream
+        self.max_streams = max_streams
+        self.streams = OrderedDict()
+
+        # 统计信息
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, stream_id, frame_hash):
+        """
+        查找近似重复帧
+
+        Args:
+            stream_id: 视频流ID
+            frame_hash: 帧的感知哈希
+
+        Returns:
+            value: 缓存的值，未命中时返回None
+        """
+        entries = self.streams.get(stream_id)
+        if entries is not None:
+            self.streams.move_to_end(stream_id)
+            for cached_hash in reversed(entries):
+                if hamming_distance(cached_hash, frame_hash) <= self.max_distance:
+                    entries.move_to_end(cached_hash)
+                    self.hits += 1
+                    return entries[cached_hash]
+        self.misses += 1
+        return None
+
+    def put(self, stream_id, frame_hash, value):
+        """
+        写入缓存
+
+        Args:
+            stream_id: 视频流ID
+            frame_hash: 帧的感知哈希
+            value: 缓存的值
+        """
+        entries = self.streams.get(stream_id)
+        if entries is None:
+            entries = OrderedDict()
+            self.streams[stream_id] = entries
+            if len(self.streams) > self.max_streams:
+                self.streams.popitem(last=False)
+        self.streams.move_to_end(stream_id)
+        entries[frame_hash] = value
+        entries.move_to_end(frame_hash)
+        if len(entries) > self.max_entries_per_stream:
+            entries.popitem(last=False)
+
+    def clear(self, stream_id=None):
+        """
+        清空某路视频流或全部缓存
+        """
+        if stream_id is None:
+            self.streams.clear()
+        else:
+            self.streams.pop(stream_id, None)
+
+    def memory_bytes(self):
+        """
+        估算缓存中张量占用的内存
+        """
+        total = 0
+        for entries in self.streams.values():
+            for value in entries.values():
+                for item in value if isinstance(value, tuple) else (value,):
+                    if hasattr(item, 'element_size') and hasattr(item, 'nelement'):
+                        total += item.element_size() * item.nelement()
+        return total
+
+    def stats(self):
+        """
+        获取缓存统计信息
+
+        Returns:
+            stats: 统计信息字典
+        """
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'streams': len(self.streams),
+            'entries': sum(len(entries) for entries in self.streams.values()),
+            'memory_bytes': self.memory_bytes(),
+            'max_distance': self.max_distance
+        }
+
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram:
+    """
+    固定分桶的直方图，可在多个线程中并发记录
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # 最后一个桶为 +Inf
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+            self.count += 1
+
+
+class ServiceMetrics:
+    """
+    服务指标收集，按 Prometheus 文本格式导出
+
+    支持直方图、计数器和仪表盘三种指标，关闭时所有记录操作直接返回
+    """
+
+    def __init__(self, prefix='clip', enabled=True, buckets=DEFAULT_BUCKETS):
+        """
+        初始化指标收集
+
+        Args:
+            prefix: 指标名前缀
+            enabled: 是否启用
+            buckets: 直方图分桶上界(秒)
+        """
+        self.prefix = prefix
+        self.enabled = enabled
+        self.buckets = buckets
+        self.types = {}
+        self.histograms = {}
+        self.values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, name, metric_type, labels):
+        if name not in self.types:
+            # 新指标可能在执行器线程中首次出现，与 render 的遍历互斥
+            with self._lock:
+                self.types.setdefault(name, metric_type)
+        return name, tuple(sorted(labels.items()))
+
+    def observe(self, name, value, **labels):
+        """
+        记录直方图观测值
+        """
+        if not self.enabled:
+            return
+        key = self._key(name, 'histogram', labels)
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            with self._lock:
+                histogram = self.histograms.setdefault(key, Histogram(self.buckets))
+        histogram.observe(value)
+
+    def inc(self, name, amount=1, **labels):
+        """
+        计数器累加
+        """
+        if not self.enabled:
+            return
+        key = self._key(name, 'counter', labels)
+        with self._lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def set(self, name, value, **labels):
+        """
+        设置仪表盘的值
+        """
+        if not self.enabled:
+            return
+        key = self._key(name, 'gauge', labels)
+        with self._lock:
+            self.values[key] = value
+
+    @contextmanager
+    def timer(self, name, **labels):
+        """
+        计时上下文，将耗时(秒)记入直方图
+        """
+        if not self.enabled:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    @staticmethod
+    def _format_labels(labels, extra=None):
+        items = list(labels) + ([extra] if extra else [])
+        if not items:
+            return ''
+        return '{' + ','.join(f'{k}="{v}"' for k, v in items) + '}'
+
+    def render(self):
+        """
+        导出 Prometheus 文本格式
+
+        Returns:
+            text: 指标文本
+        """
+        lines = []
+        with self._lock:
+            types = dict(self.types)
+            histograms = sorted(self.histograms.items())
+            values = sorted(self.values.items())
+
+        for name in sorted(types):
+            full_name = f"{self.prefix}_{name}"
+            lines.append(f"# TYPE {full_name} {types[name]}")
+            if types[name] == 'histogram':
+                for (metric_name, labels), histogram in histograms:
+                    if metric_name != name:
+                        continue
+                    cumulative = 0
+                    for bound, count in zip(self.buckets + (float('inf'),), histogram.counts):
+                        cumulative += count
+                        le = '+Inf' if bound == float('inf') else repr(bound)
+                        lines.append(f"{full_name}_bucket{self._format_labels(labels, ('le', le))} {cumulative}")
+                    lines.append(f"{full_name}_sum{self._format_labels(labels)} {histogram.sum}")
+                    lines.append(f"{full_name}_count{self._format_labels(labels)} {histogram.count}")
+            else:
+                for (metric_name, labels), value in values:
+                    if metric_name == name:
+                        lines.append(f"{full_name}{self._format_labels(labels)} {value}")
+        return '\n'.join(lines) + '\n'
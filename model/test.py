@@ -1,79 +1,1038 @@
-from fastapi import FastAPI, UploadFile, File
+from fastapi import (FastAPI, UploadFile, File, Form, Body, HTTPException, Request, WebSocket,
+                     WebSocketDisconnect)
+from fastapi.responses import JSONResponse, PlainTextResponse, Response
+from typing import Dict, List, Optional
 import clip
 import torch
 from PIL import Image
-import io
+import os
+import re
+import json
+import hashlib
+import struct
+import numpy as np
+import time
+import asyncio
+import logging
+import threading
+from collections import OrderedDict, Counter, namedtuple
+from contextlib import asynccontextmanager
+from functools import partial
+from config import Config
+from serving import (MicroBatcher, BoundedExecutor, ExecutorBusyError, StreamSessionManager, NearDuplicateCache,
+                     ServiceMetrics, TemporalSmoother)
+from frame_utils import dhash, gray_thumbnail, MotionGate, ClipPreprocessor, open_image_bytes
 
-app = FastAPI()
+
+@asynccontextmanager
+async def lifespan(app):
+    """
+    服务生命周期：启动时在后台加载模型，关闭时停止各级模型的批处理队列和推理线程池
+    """
+    # 在默认线程池中加载模型，服务启动后立即可以响应 /healthz
+    asyncio.get_running_loop().run_in_executor(None, initialize)
+    yield
+    for tier in tiers:
+        await tier.batcher.stop()
+    inference_executor.shutdown()
+
+
+app = FastAPI(lifespan=lifespan)
 device = "cuda" if torch.cuda.is_available() else "cpu"
-model, preprocess = clip.load("ViT-L/14@336px", device=device)
+torch.set_num_threads(Config.CLIP_INTRA_OP_THREADS)
+metrics = ServiceMetrics(prefix='clip', enabled=Config.METRICS_ENABLED)
+logger = logging.getLogger(__name__)
+
+# 模型在启动钩子中后台加载，加载和预热完成前 /readyz 返回503
+# tiers 按推理顺序排列，级联模式下为 [快速模型, 完整模型]，否则只有完整模型
+tiers = []
+model_state = {'status': 'starting', 'error': None, 'load_seconds': None, 'warmup_seconds': None,
+               'preprocess_parity': {}}
+
+# 各推理阶段的耗时直方图名称：STAGE_METRIC 按模型 (tier) 区分，REQUEST_STAGE_METRIC 为与模型无关的阶段
+STAGE_METRIC = 'stage_duration_seconds'
+REQUEST_STAGE_METRIC = 'request_stage_duration_seconds'
+
+# /ws/predict 每条二进制消息的头部：帧序号 (uint32)、宽、高 (uint16)
+FRAME_HEADER = struct.Struct('!IHH')
+
+# 类别名称到行为分类模型标签的映射
+CLASS_IDS = {name: class_id for class_id, name in Config.BEHAVIOR_CLASSES.items()}
+
+# 文本特征快照：类别名称、类别原型 [num_categories, dim]、全部提示词、提示词特征 [num_prompts, dim]
+# 及每条提示词所属类别的下标 [num_prompts]
+TextState = namedtuple('TextState', ['labels', 'text_features', 'prompts', 'prompt_features', 'prompt_labels'])
+
+
+def load_prompts(path=Config.CLIP_PROMPTS_FILE):
+    """
+    读取按类别分组的提示词文件
+
+    Args:
+        path: JSON文件路径，格式为 {类别名称: [提示词, ...]}，类别名称与 Config.BEHAVIOR_CLASSES 一致
+
+    Returns:
+        prompts: {类别名称: 提示词列表}，保持文件中的顺序
+    """
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def normalize_prompts(prompts):
+    """
+    校验并规范化提示词，热替换时在修改任何一级模型之前调用，保证各级类别一致
+
+    Args:
+        prompts: {类别名称: 提示词列表}，也可以是标签列表 (每个标签作为只有一条提示词的类别)
+
+    Returns:
+        prompts: {类别名称: 提示词列表}
+    """
+    if not isinstance(prompts, dict):
+        prompts = {label: [label] for label in prompts}
+    prompts = {label: list(texts) for label, texts in prompts.items()}
+    if not prompts:
+        raise ValueError("labels must not be empty")
+    empty = [label for label, texts in prompts.items() if not texts]
+    if empty:
+        raise ValueError(f"categories without prompts: {empty}")
+    return prompts
+
+
+def clip_weights_identity(name, weights_path=None):
+    """
+    获取CLIP权重文件的标识 (绝对路径、大小、修改时间)，用于区分不同权重的文本特征缓存
+
+    Args:
+        name: CLIP模型名称
+        weights_path: 本地权重文件路径
+
+    Returns:
+        identity: [路径, 大小, 修改时间(ns)]，找不到权重文件时返回None
+    """
+    path = weights_path if weights_path and os.path.isfile(weights_path) else None
+    if path is None:
+        # clip.load(name) 下载的权重按URL文件名保存在 download_root 中
+        url = getattr(getattr(clip, 'clip', None), '_MODELS', {}).get(name)
+        candidate = os.path.join(Config.CLIP_DOWNLOAD_ROOT, os.path.basename(url)) if url else None
+        path = candidate if candidate and os.path.isfile(candidate) else None
+    if path is None:
+        return None
+    stat = os.stat(path)
+    return [os.path.abspath(path), stat.st_size, stat.st_mtime_ns]
+
+
+class TextEmbeddingCache:
+    """
+    CLIP类别原型缓存
+
+    每个类别的多条提示词分别编码、L2归一化后取平均，再归一化作为该类别的原型，
+    [num_categories, dim] 原型矩阵和各提示词的特征常驻设备，每帧推理只需一次 encode_image 和两次小矩阵乘法。
+    原型矩阵按模型、权重文件、特征维度和提示词哈希保存到磁盘，单条提示词的特征也按模型保存，
+    服务重启时直接读取，修改提示词时只编码新增的提示词。
+    缓存文件中保存一条探针提示词的特征，读取时与当前模型的编码结果比对，不一致时重新计算
+    """
+
+    PROBE_PROMPT = "a photo of a street"
+
+    def __init__(self, clip_model, model_name, prompts, device, weights_path=None,
+                 cache_dir=Config.CLIP_PROMPT_CACHE_DIR):
+        """
+        初始化类别原型缓存
+
+        Args:
+            clip_model: 已加载的CLIP模型
+            model_name: 模型名称，用于区分不同模型的缓存
+            prompts: {类别名称: 提示词列表}
+            device: 原型矩阵所在设备
+            weights_path: 本地权重文件路径，其标识写入缓存键
+            cache_dir: 缓存目录，为None时不保存到磁盘
+        """
+        self.clip_model = clip_model
+        self.device = device
+        self.dtype = getattr(clip_model, 'dtype', torch.float32)
+        self.cache_dir = cache_dir
+        if cache_dir is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+        self.probe = self.encode([self.PROBE_PROMPT])[0]
+        key = json.dumps({'model': model_name, 'weights': clip_weights_identity(model_name, weights_path),
+                          'dim': self.probe.numel()})
+        self.cache_key = (f"{re.sub(r'[^A-Za-z0-9.-]+', '_', model_name)}-"
+                          f"{hashlib.sha1(key.encode('utf-8')).hexdigest()[:12]}")
+        # TextState 作为整体替换，读取方无需加锁
+        self._state = None
+        self.prompts = None
+        prompts = normalize_prompts(prompts)
+        self.commit(prompts, self.build(prompts))
+
+    def _cache_path(self, suffix):
+        return os.path.join(self.cache_dir, f"{self.cache_key}-{suffix}.pt")
+
+    def _save(self, obj, path):
+        # 先写临时文件再原子替换，并发启动的进程不会读到写了一半的文件
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        torch.save({**obj, 'probe': self.probe}, tmp_path)
+        os.replace(tmp_path, path)
+
+    def _load(self, path):
+        """
+        读取缓存文件，探针特征与当前模型不一致或文件损坏时返回None
+        """
+        if path is None or not os.path.exists(path):
+            return None
+        try:
+            cached = torch.load(path, map_location='cpu')
+            probe = cached['probe']
+        except Exception as e:
+            logger.warning("Ignoring unreadable prompt cache %s: %s", path, e)
+            return None
+        if probe.shape != self.probe.shape or float(probe @ self.probe) < 0.999:
+            logger.warning("Ignoring prompt cache %s written by a different model", path)
+            return None
+        return cached
+
+    def encode(self, texts):
+        """
+        编码并归一化提示词
+
+        Args:
+            texts: 提示词列表
+
+        Returns:
+            text_features: 归一化后的文本特征 [num_texts, dim]，float32，位于CPU
+        """
+        text_inputs = clip.tokenize(texts).to(self.device)
+        with torch.no_grad():
+            text_features = self.clip_model.encode_text(text_inputs).float()
+        return (text_features / text_features.norm(dim=-1, keepdim=True)).cpu()
+
+    def encode_prompts(self, texts):
+        """
+        获取提示词特征，优先读取按模型保存的单条提示词特征，只编码缺失的提示词
+
+        Args:
+            texts: 提示词列表
+
+        Returns:
+            features: {提示词: 特征 [dim]}
+        """
+        path = self._cache_path('prompts') if self.cache_dir is not None else None
+        cached = self._load(path)
+        store = cached['features'] if cached is not None else {}
+        missing = [text for text in dict.fromkeys(texts) if text not in store]
+        if missing:
+            store.update(zip(missing, self.encode(missing)))
+            if path is not None:
+                self._save({'features': store}, path)
+        return {text: store[text] for text in texts}
+
+    def build_prototypes(self, prompts):
+        """
+        计算各类别的原型，并按缓存键和提示词哈希缓存到磁盘
+
+        Args:
+            prompts: {类别名称: 提示词列表}
+
+        Returns:
+            cached: {'prototypes': 归一化后的类别原型 [num_categories, dim],
+                     'prompt_features': 按类别顺序排列的提示词特征 [num_prompts, dim]}，float32，位于CPU
+        """
+        digest = hashlib.sha1(json.dumps(prompts, ensure_ascii=False).encode('utf-8')).hexdigest()[:16]
+        path = self._cache_path(digest) if self.cache_dir is not None else None
+        cached = self._load(path)
+        num_prompts = sum(len(texts) for texts in prompts.values())
+        if cached is not None and cached['prompt_features'].shape == (num_prompts, self.probe.numel()):
+            return cached
+
+        features = self.encode_prompts([text for texts in prompts.values() for text in texts])
+        prompt_features = torch.stack([features[text] for texts in prompts.values() for text in texts])
+        prototypes = torch.stack([torch.stack([features[text] for text in texts]).mean(dim=0)
+                                  for texts in prompts.values()])
+        prototypes = prototypes / prototypes.norm(dim=-1, keepdim=True)
+        cached = {'prototypes': prototypes, 'prompt_features': prompt_features}
+        if path is not None:
+            self._save(cached, path)
+        return cached
+
+    def build(self, prompts):
+        """
+        编码提示词并生成新的文本特征快照，不修改当前状态；包含模型推理和磁盘读写，应在推理线程池中调用
+
+        Args:
+            prompts: normalize_prompts 规范化后的 {类别名称: 提示词列表}
+
+        Returns:
+            state: TextState
+        """
+        cached = self.build_prototypes(prompts)
+        prompt_labels = [index for index, texts in enumerate(prompts.values()) for _ in texts]
+        return TextState(labels=list(prompts),
+                         text_features=cached['prototypes'].to(self.device, self.dtype),
+                         prompts=[text for texts in prompts.values() for text in texts],
+                         prompt_features=cached['prompt_features'].to(self.device, self.dtype),
+                         prompt_labels=torch.tensor(prompt_labels, device=self.device))
+
+    def commit(self, prompts, state):
+        """
+        切换到 build 生成的文本特征快照，热替换类别和提示词，无需重启服务
+
+        Args:
+            prompts: {类别名称: 提示词列表}
+            state: build 返回的 TextState
+        """
+        self.prompts = prompts
+        self._state = state
+
+    @property
+    def labels(self):
+        return self._state[0]
+
+    def snapshot(self):
+        """
+        获取当前的文本特征
+
+        Returns:
+            state: TextState
+        """
+        return self._state
+
+
+def classify(image_features, text_features, logit_scale):
+    """
+    计算图像特征与文本特征的相似度
+
+    Args:
+        image_features: 图像特征 [batch_size, dim]
+        text_features: 归一化后的文本特征 [num_labels, dim]
+        logit_scale: CLIP模型的温度系数 (对数)
+
+    Returns:
+        similarity: 各标签概率 [batch_size, num_labels]
+    """
+    image_features = image_features / image_features.norm(dim=-1, keepdim=True)
+    logits = logit_scale.exp() * image_features @ text_features.T
+    return logits.float().softmax(dim=-1)
+
+
+class ClipTier:
+    """
+    一级CLIP模型，包含模型、图像预处理、文本特征缓存和独立的微批处理队列
+
+    级联模式下快速模型和完整模型各为一级，输入分辨率和特征维度不同，因此分别预处理和批处理
+    """
+
+    def __init__(self, name, clip_model, preprocess, prompts, weights_path=None):
+        """
+        初始化一级模型
+
+        Args:
+            name: 模型名称
+            clip_model: 已加载的CLIP模型
+            preprocess: 该模型的图像预处理函数
+            prompts: {类别名称: 提示词列表}
+            weights_path: 本地权重文件路径，用于区分文本特征缓存
+        """
+        self.name = name
+        self.model = clip_model
+        self.preprocess = preprocess
+        self.text_cache = TextEmbeddingCache(clip_model, name, prompts, device, weights_path=weights_path,
+                                             cache_dir=Config.CLIP_PROMPT_CACHE_DIR)
+        self.batcher = MicroBatcher(self.run_batch, max_batch_size=Config.CLIP_MAX_BATCH_SIZE,
+                                    max_wait_ms=Config.CLIP_MAX_WAIT_MS)
+        self.resolution = clip_model.visual.input_resolution
+        # 批量预处理：单张图像只缩放裁剪，归一化按批次完成
+        self.fast_preprocessor = ClipPreprocessor(self.resolution) if Config.CLIP_FAST_PREPROCESS else None
+
+    def verify_fast_preprocess(self):
+        """
+        检查批量预处理与模型自带 preprocess 的一致性，误差超过 Config.CLIP_PREPROCESS_TOLERANCE 时回退
+
+        Returns:
+            error: 最大绝对误差，未启用批量预处理时返回None
+        """
+        if self.fast_preprocessor is None:
+            return None
+        rng = np.random.default_rng(0)
+        image = Image.fromarray(rng.integers(0, 256, (480, 640, 3), dtype=np.uint8))
+        error = self.fast_preprocessor.parity_error(self.preprocess, image)
+        if error > Config.CLIP_PREPROCESS_TOLERANCE:
+            logger.warning("Batched preprocessing for %s differs from preprocess by %.3g, falling back",
+                           self.name, error)
+            self.fast_preprocessor = None
+        return error
+
+    def prepare(self, image):
+        """
+        单张图像的预处理：启用批量预处理时返回缩放裁剪后的uint8数组，否则返回 preprocess 的结果
+        """
+        if self.fast_preprocessor is not None:
+            return self.fast_preprocessor.crop(image)
+        return self.preprocess(image)
+
+    def make_batch(self, images):
+        """
+        将 prepare 的结果合并为模型输入 [batch_size, 3, H, W]
+        """
+        if self.fast_preprocessor is not None:
+            batch = self.fast_preprocessor.to_tensor(images)
+        else:
+            batch = torch.stack(images)
+        return batch.to(device)
+
+    def preprocess_image(self, image):
+        """
+        预处理已解码的图像
+
+        Args:
+            image: PIL图像
+
+        Returns:
+            image: 预处理结果，见 prepare
+        """
+        with metrics.timer(STAGE_METRIC, stage='preprocess', tier=self.name):
+            return self.prepare(image)
+
+    def score(self, image_features, text_state):
+        """
+        根据图像特征计算每张图像的预测结果
+
+        Args:
+            image_features: 图像特征 [batch_size, dim]
+            text_state: text_cache.snapshot() 返回的 TextState
+
+        Returns:
+            results: 每张图像的预测结果列表。category 为top-1类别，class_id 为其在 Config.BEHAVIOR_CLASSES 中的编号
+                (自定义类别为None)，label 为该类别中与图像最相似的提示词 (前端按提示词关键字映射报警类型)，
+                margin 为top-1与top-2的概率差，scores 为各类别的概率
+        """
+        labels = text_state.labels
+        with metrics.timer(STAGE_METRIC, stage='similarity', tier=self.name), torch.no_grad():
+            similarity = classify(image_features, text_state.text_features, self.model.logit_scale)
+            top = similarity.topk(min(2, similarity.shape[-1]), dim=-1)
+            # 只在top-1类别的提示词中比较，图像特征的模长不影响同一行内的排序
+            prompt_similarity = image_features @ text_state.prompt_features.T
+            in_category = text_state.prompt_labels[None, :] == top.indices[:, :1]
+            best_prompts = prompt_similarity.masked_fill(~in_category, float('-inf')).argmax(dim=-1)
+
+        results = []
+        for values, indices, probs, prompt_index in zip(top.values.tolist(), top.indices.tolist(),
+                                                        similarity.tolist(), best_prompts.tolist()):
+            category = labels[indices[0]]
+            margin = values[0] - values[1] if len(values) > 1 else values[0]
+            results.append({"label": text_state.prompts[prompt_index], "category": category,
+                            "class_id": CLASS_IDS.get(category), "confidence": values[0], "margin": margin,
+                            "scores": dict(zip(labels, probs))})
+        return results
+
+    def encode_batch(self, images):
+        """
+        对一批预处理后的图像做一次批量 encode_image 并分类
+
+        Args:
+            images: preprocess_image 的结果列表
+
+        Returns:
+            outputs: 每张图像的 (预测结果, 图像特征, 所用文本特征) 列表
+        """
+        with metrics.timer(STAGE_METRIC, stage='normalize', tier=self.name):
+            batch = self.make_batch(images)
+        text_state = self.text_cache.snapshot()
+
+        with metrics.timer(STAGE_METRIC, stage='encode_image', tier=self.name), torch.no_grad():
+            image_features = self.model.encode_image(batch)
+            if device == "cuda":
+                # 等待GPU计算完成，使计时反映真实的前向耗时
+                torch.cuda.synchronize()
+
+        results = self.score(image_features, text_state)
+        return [(result, features, text_state) for result, features in zip(results, image_features)]
+
+    async def run_batch(self, images):
+        return await inference_executor.run(self.encode_batch, images)
+
+    def warm_up(self):
+        """
+        用空白图像按单帧和最大批次各推理一次，提前完成算子初始化和显存/内存分配，
+        避免第一个真实请求承担这部分延迟。直接调用模型，预热耗时不计入各阶段指标
+        """
+        image = self.prepare(Image.new('RGB', (640, 480)))
+        text_features = self.text_cache.snapshot().text_features
+        with torch.no_grad():
+            for batch_size in sorted({1, Config.CLIP_MAX_BATCH_SIZE}):
+                image_features = self.model.encode_image(self.make_batch([image] * batch_size))
+                classify(image_features, text_features, self.model.logit_scale)
+
+
+def open_image(image_bytes, raw_size=None):
+    """
+    解码上传的图像，JPEG按各级模型中最大的输入分辨率缩小解码
+
+    Args:
+        image_bytes: 图像文件字节或原始RGB数据
+        raw_size: 原始RGB数据的 (宽, 高)
+
+    Returns:
+        image: PIL图像
+    """
+    min_size = max(tier.resolution for tier in tiers) if Config.CLIP_JPEG_DRAFT else None
+    with metrics.timer(REQUEST_STAGE_METRIC, stage='decode'):
+        return open_image_bytes(image_bytes, min_size, raw_size)
+
+
+def load_image(image_bytes, tier, raw_size=None):
+    """
+    解码上传的图像并按指定模型预处理
+
+    Args:
+        image_bytes: 图像文件字节或原始RGB数据
+        tier: 使用的模型
+        raw_size: 原始RGB数据的 (宽, 高)
+
+    Returns:
+        image: PIL图像
+        tensor: 预处理结果
+    """
+    image = open_image(image_bytes, raw_size)
+    return image, tier.preprocess_image(image)
+
+
+def decode_image(image_bytes, raw_size=None):
+    """
+    解码上传的图像，并计算近似重复检测用的感知哈希和运动检测用的缩略图
+
+    Args:
+        image_bytes: 图像文件字节或原始RGB数据
+        raw_size: 原始RGB数据的 (宽, 高)
+
+    Returns:
+        image: PIL图像
+        frame_hash: 感知哈希，未启用近似重复帧缓存时为None
+        thumbnail: 灰度缩略图，未启用运动门控时为None
+    """
+    image = open_image(image_bytes, raw_size)
+    with metrics.timer(REQUEST_STAGE_METRIC, stage='fingerprint'):
+        frame_hash = dhash(image, Config.DEDUP_HASH_SIZE) if frame_cache is not None else None
+        thumbnail = gray_thumbnail(image, Config.MOTION_THUMBNAIL_SIZE) if Config.MOTION_GATE_ENABLED else None
+    return image, frame_hash, thumbnail
+
+
+def load_clip_model(name, weights_path=None):
+    """
+    加载CLIP模型，配置了本地权重文件 (预先下载或转换好的检查点) 时直接从该文件加载
+
+    Args:
+        name: CLIP模型名称
+        weights_path: 本地权重文件路径
+
+    Returns:
+        model: CLIP模型
+        preprocess: 图像预处理函数
+    """
+    if weights_path and os.path.isfile(weights_path):
+        return clip.load(weights_path, device=device)
+    return clip.load(name, device=device, download_root=Config.CLIP_DOWNLOAD_ROOT)
+
+
+def initialize():
+    """
+    加载模型、编码默认标签并预热，在后台线程中执行，进度记录在 model_state 中
+    """
+    global tiers
+    try:
+        model_state['status'] = 'loading'
+        start = time.perf_counter()
+        prompts = load_prompts(Config.CLIP_PROMPTS_FILE)
+        model_specs = [(Config.CLIP_MODEL, Config.CLIP_WEIGHTS_PATH)]
+        if Config.CLIP_CASCADE_ENABLED:
+            model_specs.insert(0, (Config.CLIP_FAST_MODEL, Config.CLIP_FAST_WEIGHTS_PATH))
+        loaded = []
+        for name, weights_path in model_specs:
+            clip_model, clip_preprocess = load_clip_model(name, weights_path)
+            loaded.append(ClipTier(name, clip_model, clip_preprocess, prompts, weights_path))
+        model_state['load_seconds'] = time.perf_counter() - start
+        metrics.set('model_load_seconds', model_state['load_seconds'])
+        model_state['preprocess_parity'] = {tier.name: tier.verify_fast_preprocess() for tier in loaded}
+
+        if Config.CLIP_WARMUP:
+            model_state['status'] = 'warming_up'
+            start = time.perf_counter()
+            for tier in loaded:
+                tier.warm_up()
+            model_state['warmup_seconds'] = time.perf_counter() - start
+            metrics.set('warmup_seconds', model_state['warmup_seconds'])
+        tiers = loaded
+        model_state['status'] = 'ready'
+    except Exception as e:
+        model_state.update(status='failed', error=f"{type(e).__name__}: {e}")
+        logger.exception("Failed to load CLIP model")
+
+
+def is_ready():
+    return model_state['status'] == 'ready'
+
+
+inference_executor = BoundedExecutor(max_workers=Config.CLIP_INFERENCE_WORKERS,
+                                     max_pending=Config.CLIP_MAX_PENDING)
+prompt_update_lock = asyncio.Lock()
+
+
+def create_smoother():
+    """
+    按配置为新的视频流会话创建时序平滑器
+    """
+    return TemporalSmoother(method=Config.SMOOTHING_METHOD, alpha=Config.SMOOTHING_ALPHA,
+                            window=Config.SMOOTHING_WINDOW,
+                            enter_threshold=Config.SMOOTHING_ENTER_THRESHOLD,
+                            exit_threshold=Config.SMOOTHING_EXIT_THRESHOLD,
+                            heartbeat_interval=Config.SMOOTHING_HEARTBEAT_INTERVAL)
+
+
+sessions = StreamSessionManager(target_fps=Config.STREAM_TARGET_FPS, session_ttl=Config.STREAM_SESSION_TTL,
+                                smoother_factory=create_smoother if Config.SMOOTHING_ENABLED else None)
+frame_cache = NearDuplicateCache(max_distance=Config.DEDUP_MAX_DISTANCE,
+                                 max_entries_per_stream=Config.DEDUP_CACHE_SIZE) if Config.DEDUP_ENABLED else None
+cascade_counts = Counter()
+
+
+def escalation_reason(result):
+    """
+    判断快速模型的结果是否需要交给下一级模型确认
+
+    Args:
+        result: 快速模型的预测结果
+
+    Returns:
+        reason: 升级原因，无需升级时返回None
+    """
+    if result['confidence'] < Config.CLIP_CASCADE_MIN_CONFIDENCE:
+        return 'low_confidence'
+    if result['margin'] < Config.CLIP_CASCADE_MIN_MARGIN:
+        return 'low_margin'
+    if Config.CLIP_CASCADE_ESCALATE_ANOMALIES and result['category'] not in Config.CLIP_NORMAL_LABELS:
+        return 'anomaly'
+    return None
+
+
+async def run_cascade(image, tensor=None):
+    """
+    依次用各级模型推理，前一级结果足够确定时直接返回，不再运行更大的模型
+
+    Args:
+        image: PIL图像
+        tensor: 已按第一级模型预处理的结果，为None时在这里预处理
+
+    Returns:
+        result: 预测结果，tier 为给出结果的模型
+        features: 该模型的图像特征
+        text_state: 所用文本特征
+        tier: 给出结果的模型
+    """
+    for level, tier in enumerate(tiers):
+        if tensor is None or level > 0:
+            tensor = await inference_executor.run(tier.preprocess_image, image)
+        result, features, text_state = await tier.batcher.submit(tensor)
+        if level == len(tiers) - 1:
+            break
+        reason = escalation_reason(result)
+        if reason is None:
+            break
+        cascade_counts[reason] += 1
+        metrics.inc('cascade_escalations_total', reason=reason)
+
+    if len(tiers) > 1:
+        cascade_counts['frames'] += 1
+        cascade_counts[f'answered:{tier.name}'] += 1
+        metrics.inc('cascade_answers_total', tier=tier.name)
+    return {**result, "tier": tier.name}, features, text_state, tier
+
+
+def cascade_stats():
+    """
+    汇总级联推理的统计信息，escalation_rate 为交给完整模型的帧比例
+    """
+    frames = cascade_counts['frames']
+    escalated = frames - cascade_counts[f'answered:{tiers[0].name}'] if tiers else 0
+    return {
+        'enabled': len(tiers) > 1,
+        'tiers': [tier.name for tier in tiers],
+        'frames': frames,
+        'escalated': escalated,
+        'escalation_rate': escalated / frames if frames else 0.0,
+        'reasons': {reason: cascade_counts[reason] for reason in ('low_confidence', 'low_margin', 'anomaly')},
+        'answered': {tier.name: cascade_counts[f'answered:{tier.name}'] for tier in tiers}
+    }
+
+
+motion_gates = OrderedDict()
+MAX_MOTION_GATES = 256
+
+
+def get_motion_gate(stream_id):
+    """
+    获取视频流的运动门控，超过上限时淘汰最久未使用的
+
+    Args:
+        stream_id: 视频流ID
+
+    Returns:
+        gate: MotionGate
+    """
+    gate = motion_gates.get(stream_id)
+    if gate is None:
+        gate = MotionGate(pixel_threshold=Config.MOTION_PIXEL_THRESHOLD,
+                          area_threshold=Config.MOTION_AREA_THRESHOLD,
+                          refresh_interval=Config.MOTION_REFRESH_INTERVAL,
+                          thumbnail_size=Config.MOTION_THUMBNAIL_SIZE)
+        motion_gates[stream_id] = gate
+        if len(motion_gates) > MAX_MOTION_GATES:
+            motion_gates.popitem(last=False)
+    motion_gates.move_to_end(stream_id)
+    return gate
+
+
+def rescore_stale(features, result, text_state, tier):
+    """
+    缓存结果所用的文本特征已被热替换时，用缓存的图像特征按当前标签重新打分，只需一次矩阵乘法
+
+    Args:
+        features: 图像特征 [dim]
+        result: 缓存的预测结果
+        text_state: 计算该结果时的文本特征快照
+        tier: 给出结果的模型
+
+    Returns:
+        entry: (features, result, text_state, tier)，结果与当前文本特征一致
+    """
+    current = tier.text_cache.snapshot()
+    if text_state is current:
+        return features, result, text_state, tier
+    return features, {**result, **tier.score(features.unsqueeze(0), current)[0]}, current, tier
+
+
+async def infer(image_bytes, stream_id=None, raw_size=None):
+    """
+    解码并推理单帧。同一视频流中，画面静止的帧复用上一次结果，近似重复帧复用缓存结果
+
+    Args:
+        image_bytes: 图像文件字节或原始RGB数据
+        stream_id: 视频流ID，为None时逐帧推理
+        raw_size: 原始RGB数据的 (宽, 高)，为None时按图像文件解码
+
+    Returns:
+        result: 预测结果
+    """
+    if stream_id is None or (frame_cache is None and not Config.MOTION_GATE_ENABLED):
+        image, tensor = await inference_executor.run(load_image, image_bytes, tiers[0], raw_size)
+        result, _, _, _ = await run_cascade(image, tensor)
+        return result
+
+    image, frame_hash, thumbnail = await inference_executor.run(decode_image, image_bytes, raw_size)
+
+    # 运动门控：画面静止时直接返回上一次结果
+    gate = get_motion_gate(stream_id) if thumbnail is not None else None
+    reason = gate.check(thumbnail) if gate is not None else None
+    if gate is not None and reason is None and gate.last_result is not None:
+        gate.last_result = rescore_stale(*gate.last_result)
+        return {**gate.last_result[1], "motion": False}
+
+    # 强制刷新的帧跳过近似重复缓存，否则静止画面的哈希总能命中，模型永远不会重新推理
+    use_cache = frame_cache is not None and reason != 'refresh'
+    cached = frame_cache.get(stream_id, frame_hash) if use_cache else None
+    if cached is not None:
+        features, result, text_state, tier = rescore_stale(*cached)
+        result = {**result, "cached": True}
+    else:
+        result, features, text_state, tier = await run_cascade(image)
+        # 拷贝单行特征，避免缓存引用整个批次的张量
+        features = features.clone()
+        if frame_cache is not None:
+            frame_cache.put(stream_id, frame_hash, (features, result, text_state, tier))
+        result = {**result, "cached": False}
+
+    if gate is not None:
+        gate.last_result = (features, result, text_state, tier)
+    return {**result, "motion": True}
+
+
+def smooth_result(session, result):
+    """
+    用视频流的时序平滑器更新状态
+
+    Args:
+        session: 视频流会话
+        result: 单帧预测结果
+
+    Returns:
+        event: 'change'、'heartbeat' 或 None (状态未变化，只发送事件时不需要返回)
+        smoothed: 平滑后的状态，未启用平滑时为None
+    """
+    smoother = session.smoother
+    if smoother is None:
+        return None, None
+    now = time.monotonic()
+    event = smoother.update(result['scores'], now)
+    metrics.inc('stream_events_total', event=event or 'suppressed')
+    smoothed = smoother.snapshot(now)
+    smoothed['class_id'] = CLASS_IDS.get(smoothed['label'])
+    return event, smoothed
+
+
+def motion_stats():
+    """
+    汇总各视频流运动门控的统计信息
+    """
+    checked = sum(gate.checked for gate in motion_gates.values())
+    skipped = sum(gate.skipped for gate in motion_gates.values())
+    return {
+        'streams': len(motion_gates),
+        'checked': checked,
+        'skipped': skipped,
+        'skip_rate': skipped / checked if checked else 0.0
+    }
+
+
+async def process_frame(image_bytes, stream_id=None, target_fps=None, raw_size=None, events_only=False):
+    """
+    处理单帧，/predict 和 /ws/predict 共用
+
+    Args:
+        image_bytes: 图像文件字节或原始RGB数据
+        stream_id: 视频流ID，为None时逐帧推理
+        target_fps: 目标分析帧率，为None时使用会话当前值
+        raw_size: 原始RGB数据的 (宽, 高)，为None时按图像文件解码
+        events_only: 是否只在平滑状态变化或到达心跳间隔时返回结果
+
+    Returns:
+        status: 请求状态，用于指标统计
+        result: 预测结果，为None时无需返回内容
+    """
+    if raw_size is not None and len(image_bytes) != raw_size[0] * raw_size[1] * 3:
+        raise ValueError(f"raw RGB payload must be {raw_size[0] * raw_size[1] * 3} bytes, got {len(image_bytes)}")
+    # 不带视频流ID的请求逐帧推理
+    if stream_id is None:
+        return 'ok', await infer(image_bytes, raw_size=raw_size)
+
+    session, result = await sessions.submit(stream_id, image_bytes,
+                                            partial(infer, stream_id=stream_id, raw_size=raw_size), target_fps)
+    # events_only 时只在平滑状态变化或到达心跳间隔时返回事件
+    events_only = events_only and session.smoother is not None
+    if result is None:
+        # 该帧被同一视频流的更新帧替换，返回最近一次结果；还没有结果时不返回内容 (/predict 返回204)
+        if events_only or session.last_result is None:
+            return 'dropped', None
+        return 'dropped', {**session.last_result, "stream_id": stream_id, "dropped": True}
+
+    event, smoothed = smooth_result(session, result)
+    if events_only:
+        if event is None:
+            return 'suppressed', None
+        return 'ok', {"stream_id": stream_id, "event": event, "smoothed": smoothed}
+    return 'ok', {**result, "stream_id": stream_id, "dropped": False, "event": event, "smoothed": smoothed}
+
+
+@app.middleware("http")
+async def admit_predict(request: Request, call_next):
+    """
+    /predict 的准入控制
+
+    FastAPI 在调用接口函数之前就会读取并缓冲整个 multipart 上传，因此准入放在中间件中，
+    在读取请求体之前完成，在途请求数同时限制了上传缓冲
+    """
+    if request.method != "POST" or request.url.path != "/predict":
+        return await call_next(request)
+    start = time.perf_counter()
+    # 接口函数据此计算上传接收和解析的耗时
+    request.state.received_at = start
+    try:
+        with inference_executor.admit():
+            return await call_next(request)
+    except ExecutorBusyError:
+        metrics.inc('requests_total', status='busy')
+        metrics.observe('request_duration_seconds', time.perf_counter() - start, status='busy')
+        return JSONResponse(status_code=503, content={"error": "busy"})
+
 
 @app.post("/predict")
-async def predict(image: UploadFile = File(...)):
-    image_bytes = await image.read()
-    image = Image.open(io.BytesIO(image_bytes))
-    image = preprocess(image).unsqueeze(0).to(device)
-
-    labels = [
-        "normal",
-
-        # 虐待 (Abuse)
-        "physical abuse in a domestic setting",
-        "child abuse incident captured on video",
-        "elder abuse in a care facility",
-        "domestic violence with visible injuries",
-
-        # 火灾 (Fire)
-        "fire spreading across building",
-        "building burning with heavy smoke",
-        "flames consuming structure",
-        "smoke billowing from burning site",
-        "house fire with active flames",
-
-        # 打架 (Fighting)
-        "violent physical confrontation",
-        "people throwing punches at each other",
-        "aggressive physical altercation between individuals",
-        "people engaged in fistfight",
-        "violent brawl with pushing and shoving",
-        "crowd fight with multiple participants",
-        "street fight with physical violence",
-        "bar fight with aggressive combat",
-        "public physical altercation",
-        "group fighting with chaotic movements",
-        "Two people are fighting",
-        "A group of people are fighting",
-
-        # 盗窃 (Theft)
-        "theft incident in a public area",
-        "pickpocketing event in a crowded location",
-        "burglary with forced entry at night",
-        "shoplifting captured in a retail store",
-        "robbery confrontation with visible threat",
-
-        # 爆炸 (Explosion)
-        "explosion incident in an urban environment",
-        "bomb explosion with a visible shockwave",
-        "industrial explosion with debris and fire",
-        "sudden explosion in a public venue",
-
-        # 枪击 (Shooting)
-        "gun shooting incident in a crowded area",
-        "active shooter scenario with police response",
-        "mass shooting event with multiple casualties",
-        "urban shooting scene with visible gunfire"
-    ]
-
-    text_inputs = clip.tokenize(labels).to(device)
-
-    with torch.no_grad():
-        image_features = model.encode_image(image)
-        text_features = model.encode_text(text_inputs)
-        similarity = (image_features @ text_features.T).softmax(dim=-1)
-
-    best_idx = similarity.argmax().item()
-    return {"label": labels[best_idx], "confidence": similarity[0, best_idx].item()}
+async def predict(request: Request, image: UploadFile = File(...), stream_id: Optional[str] = Form(None),
+                  target_fps: Optional[float] = Form(None), width: Optional[int] = Form(None),
+                  height: Optional[int] = Form(None), events_only: bool = Form(False)):
+    # 从中间件收到请求头开始计时，包含上传接收和 multipart 解析
+    start = request.state.received_at
+    status = 'error'
+    try:
+        if not is_ready():
+            status = 'not_ready'
+            return JSONResponse(status_code=503, content={"error": "not ready", "status": model_state['status']})
+        # 同时给出 width 和 height 时，上传内容为原始RGB数据 (uint8，按行存储)，跳过图像解码
+        raw_size = (width, height) if width is not None and height is not None else None
+        # 准入控制在 admit_predict 中间件中完成
+        image_bytes = await image.read()
+        metrics.observe(REQUEST_STAGE_METRIC, time.perf_counter() - start, stage='read')
+        status, result = await process_frame(image_bytes, stream_id, target_fps, raw_size, events_only)
+        # 被丢弃或平滑状态未变化的帧返回204
+        return result if result is not None else Response(status_code=204)
+    except ValueError as e:
+        status = 'bad_request'
+        return JSONResponse(status_code=400, content={"error": str(e)})
+    finally:
+        metrics.inc('requests_total', status=status)
+        metrics.observe('request_duration_seconds', time.perf_counter() - start, status=status)
+
+
+@app.websocket("/ws/predict")
+async def predict_stream(websocket: WebSocket, stream_id: Optional[str] = None, target_fps: Optional[float] = None,
+                         events_only: bool = False):
+    """
+    持久连接的二进制帧推理
+
+    每条二进制消息为 FRAME_HEADER (序号、宽、高，网络字节序) 加帧数据，宽高为0时帧数据为图像文件，
+    否则为原始RGB数据。最多 Config.WS_MAX_IN_FLIGHT 帧同时推理，结果按序号顺序以JSON文本返回，
+    并带有 "seq" 字段。events_only 时被丢弃或平滑状态未变化的帧不返回结果
+    """
+    await websocket.accept()
+    if not is_ready():
+        await websocket.close(code=1013, reason="model not ready")
+        return
+
+    pending = asyncio.Queue()
+    slots = asyncio.Semaphore(Config.WS_MAX_IN_FLIGHT)
+
+    async def handle(seq, image_bytes, raw_size, start):
+        status = 'error'
+        try:
+            with inference_executor.admit():
+                status, result = await process_frame(image_bytes, stream_id, target_fps, raw_size, events_only)
+            return {**result, "seq": seq} if result is not None else None
+        except ValueError as e:
+            status = 'bad_request'
+            return {"seq": seq, "error": str(e)}
+        except ExecutorBusyError:
+            status = 'busy'
+            return {"seq": seq, "error": "busy"}
+        except asyncio.CancelledError:
+            # 连接断开时取消的在途帧
+            status = 'cancelled'
+            raise
+        except Exception:
+            logger.exception("Frame %s failed", seq)
+            return {"seq": seq, "error": "internal error"}
+        finally:
+            metrics.inc('ws_frames_total', status=status)
+            metrics.observe('ws_frame_duration_seconds', time.perf_counter() - start, status=status)
+
+    async def send_results():
+        try:
+            # 按接收顺序等待每帧的结果，保证返回顺序
+            while True:
+                message = await (await pending.get())
+                if message is not None:
+                    await websocket.send_json(message)
+                slots.release()
+        finally:
+            # 发送失败 (连接已断开) 时唤醒接收循环
+            slots.release()
+
+    sender = asyncio.create_task(send_results())
+    try:
+        while True:
+            # 在途帧达到上限时暂停读取，由TCP流控让客户端放慢发送
+            await slots.acquire()
+            if sender.done():
+                break
+            message = await websocket.receive()
+            if message['type'] == 'websocket.disconnect':
+                break
+            data = message.get('bytes')
+            if data is None or len(data) < FRAME_HEADER.size:
+                await websocket.close(code=1003, reason="expected binary frames with a sequence header")
+                break
+            seq, width, height = FRAME_HEADER.unpack_from(data)
+            raw_size = (width, height) if width and height else None
+            pending.put_nowait(asyncio.create_task(
+                handle(seq, data[FRAME_HEADER.size:], raw_size, time.perf_counter())))
+    except WebSocketDisconnect:
+        pass
+    finally:
+        sender.cancel()
+        while not pending.empty():
+            pending.get_nowait().cancel()
+
+
+@app.get("/sessions")
+async def get_sessions():
+    return {"sessions": sessions.stats()}
+
+
+@app.get("/stats")
+async def get_stats():
+    return {
+        "batcher": {tier.name: tier.batcher.stats() for tier in tiers},
+        "executor": inference_executor.stats(),
+        "dedup": frame_cache.stats() if frame_cache is not None else None,
+        "motion": motion_stats(),
+        "cascade": cascade_stats()
+    }
+
+
+@app.get("/metrics")
+async def get_metrics():
+    if not metrics.enabled:
+        raise HTTPException(status_code=404, detail="metrics disabled")
+    executor_stats = inference_executor.stats()
+    metrics.set('requests_in_flight', executor_stats['in_flight'])
+    for tier in tiers:
+        metrics.set('batch_queue_depth', tier.batcher.stats()['queue_depth'], tier=tier.name)
+    metrics.set('stream_sessions', len(sessions.sessions))
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/healthz")
+async def healthz():
+    # 存活探针：进程能响应即可，模型加载失败时返回500以便重启
+    if model_state['status'] == 'failed':
+        return JSONResponse(status_code=500, content={"status": "failed", "model": model_state})
+    return {"status": "alive", "model": model_state}
+
+
+@app.get("/readyz")
+async def readyz():
+    # 就绪探针：模型加载并预热完成后才接收流量
+    if not is_ready():
+        return JSONResponse(status_code=503, content={"status": model_state['status'], "model": model_state})
+    return {"status": "ready", "model": model_state}
+
+
+@app.get("/labels")
+async def get_labels():
+    if not is_ready():
+        raise HTTPException(status_code=503, detail="model not ready")
+    return {"labels": tiers[-1].text_cache.labels, "prompts": tiers[-1].text_cache.prompts}
+
+
+@app.put("/labels")
+async def update_labels(labels: List[str] = Body(..., embed=True)):
+    # 每个标签作为只有一条提示词的类别
+    return await update_prompts({label: [label] for label in labels})
+
+
+@app.put("/prompts")
+async def update_prompts(prompts: Dict[str, List[str]] = Body(..., embed=True)):
+    if not is_ready():
+        raise HTTPException(status_code=503, detail="model not ready")
+    try:
+        prompts = normalize_prompts(prompts)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    # 编码和缓存读写在推理线程池中执行，不阻塞事件循环；全部模型编码完成后再一起切换，
+    # 各级模型的类别始终一致。加锁避免并发更新交错
+    async with prompt_update_lock:
+        states = [await inference_executor.run(tier.text_cache.build, prompts) for tier in tiers]
+        for tier, state in zip(tiers, states):
+            tier.text_cache.commit(prompts, state)
+    return {"labels": tiers[-1].text_cache.labels, "prompts": tiers[-1].text_cache.prompts}
+
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
+    # 帧数据已是压缩图像，关闭 permessage-deflate 避免每帧重复压缩
+    uvicorn.run(app, host="0.0.0.0", port=8000, ws_per_message_deflate=False)
@@ -0,0 +1,50 @@
+import os
+import sys
+
+import cv2
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+ultralytics = pytest.importorskip("ultralytics")
+
+from config import Config
+from dataset import extract_yolo_features, get_frame_transform
+
+
+@pytest.fixture(scope="module")
+def yolo():
+    try:
+        return ultralytics.YOLO(Config.YOLO_MODEL)
+    except Exception as e:
+        pytest.skip(f"cannot load {Config.YOLO_MODEL}: {e}")
+
+
+@pytest.fixture(scope="module")
+def frames():
+    # Ultralytics 自带的真实图片，按 extract_frames 的方式转为RGB并缩放；
+    # 额外加入一张调暗的帧，使归一化后有的帧最大值超过1、有的不超过1
+    images = []
+    for name in ("bus.jpg", "zidane.jpg"):
+        image = cv2.imread(str(ultralytics.utils.ASSETS / name))
+        images.append(cv2.resize(cv2.cvtColor(image, cv2.COLOR_BGR2RGB), Config.FRAME_SIZE))
+    images.append((images[0] * 0.3).astype(np.uint8))
+    return images
+
+
+def per_frame_features(yolo, frames):
+    return np.concatenate([extract_yolo_features(yolo, [frame]) for frame in frames])
+
+
+def test_batched_tensor_features_match_per_frame(yolo, frames):
+    transform = get_frame_transform()
+    tensors = [transform(frame) for frame in frames]
+    assert {bool(t.max() > 1.0) for t in tensors} == {True, False}
+    np.testing.assert_allclose(extract_yolo_features(yolo, tensors), per_frame_features(yolo, tensors),
+                               rtol=1e-3, atol=1e-2)
+
+
+def test_batched_array_features_match_per_frame(yolo, frames):
+    np.testing.assert_allclose(extract_yolo_features(yolo, frames), per_frame_features(yolo, frames),
+                               rtol=1e-3, atol=1e-2)
@@ -5,6 +5,7 @@ from torch.optim.lr_scheduler import ReduceLROnPlateau
 import numpy as np
 import time
 import os
+import contextlib
 from tqdm import tqdm
 import logging
 from datetime import datetime
@@ -12,7 +13,8 @@ from datetime import datetime
 from config import Config
 from data_utils import get_video_paths, split_dataset, visualize_dataset_distribution
 from dataset import get_data_loaders
-from models import YOLOLSTM, YOLOLSTMv2
+from packed_features import load_packed_splits, get_packed_data_loaders
+from models import build_model
 from utils import EarlyStopping, plot_confusion_matrix, save_classification_report, plot_training_history, \
     calculate_metrics
 
@@ -47,6 +49,92 @@ def setup_logger():
     return logger
 
 
+def get_autocast_context():
+    """
+    获取混合精度上下文，未开启 Config.USE_AMP 时为空上下文
+
+    Returns:
+        context: autocast上下文
+    """
+    if not Config.USE_AMP:
+        return contextlib.nullcontext()
+    amp_dtype = torch.float16 if Config.DEVICE.type == 'cuda' else torch.bfloat16
+    return torch.autocast(device_type=Config.DEVICE.type, dtype=amp_dtype)
+
+
+def create_grad_scaler():
+    """
+    创建梯度缩放器，仅在CUDA上使用fp16时启用 (bf16不需要缩放)
+
+    Returns:
+        scaler: GradScaler
+    """
+    enabled = Config.USE_AMP and Config.DEVICE.type == 'cuda'
+    if hasattr(torch, 'amp') and hasattr(torch.amp, 'GradScaler'):
+        return torch.amp.GradScaler('cuda', enabled=enabled)
+    return torch.cuda.amp.GradScaler(enabled=enabled)
+
+
+def load_data():
+    """
+    按 Config.USE_PACKED_FEATURES 获取数据集划分和数据加载器，训练和量化评估使用同一条数据路径
+
+    Returns:
+        dataset_splits: 数据集划分
+        data_loaders: {'train', 'val', 'test'} 数据加载器
+    """
+    if Config.USE_PACKED_FEATURES:
+        # 打包特征中已保存划分结果，保证与打包时一致
+        dataset_splits = load_packed_splits(Config.PACKED_FEATURES_DIR)
+        data_loaders = get_packed_data_loaders(Config.PACKED_FEATURES_DIR)
+    else:
+        video_paths, labels = get_video_paths(Config.DATA_ROOT)
+        dataset_splits = split_dataset(video_paths, labels)
+        data_loaders = get_data_loaders(dataset_splits)
+    return dataset_splits, data_loaders
+
+
+def compile_model(model, logger):
+    """
+    使用torch.compile编译模型，不支持或编译失败时回退到eager模式
+
+    torch.compile 在第一次前向传播时才真正编译，这里用一个假批次分别跑一次训练和推理的前向传播，
+    编译错误在训练开始前暴露并回退，不修改全局的 dynamo 配置
+
+    Args:
+        model: 模型
+        logger: 日志记录器
+
+    Returns:
+        model: 编译后的模型 (与原模型共享参数)，或原模型
+    """
+    if not Config.USE_COMPILE:
+        return model
+    if not hasattr(torch, 'compile'):
+        logger.warning("torch.compile is not available, falling back to eager mode")
+        return model
+    was_training = model.training
+    try:
+        compiled = torch.compile(model)
+        inputs = torch.zeros(Config.BATCH_SIZE, Config.SAMPLE_FRAMES, Config.YOLO_FEATURE_SIZE,
+                             device=Config.DEVICE)
+        model.train()
+        with get_autocast_context():
+            outputs = compiled(inputs)
+        outputs.float().sum().backward()
+        model.eval()
+        with torch.no_grad(), get_autocast_context():
+            compiled(inputs)
+        return compiled
+    except Exception as e:
+        logger.warning(f"torch.compile failed ({e}), falling back to eager mode")
+        return model
+    finally:
+        # 预编译产生的梯度不能带入第一次参数更新
+        model.zero_grad(set_to_none=True)
+        model.train(was_training)
+
+
 def train():
     """
     训练模型
@@ -61,24 +149,23 @@ def train():
     if torch.cuda.is_available():
         torch.cuda.manual_seed_all(42)
 
-    # 获取数据
+    # 获取数据和数据加载器
     logger.info("Loading data...")
-    video_paths, labels = get_video_paths(Config.DATA_ROOT)
-    dataset_splits = split_dataset(video_paths, labels)
+    dataset_splits, data_loaders = load_data()
 
     # 可视化数据集分布
     visualize_dataset_distribution(dataset_splits)
 
-    # 获取数据加载器
-    logger.info("Preparing data loaders...")
-    data_loaders = get_data_loaders(dataset_splits)
-
     # 创建模型
-    logger.info("Creating model...")
-    # model = YOLOLSTM()  # 使用基础模型
-    model = YOLOLSTMv2()  # 使用改进模型
+    logger.info(f"Creating model {Config.MODEL_TYPE}...")
+    model = build_model(Config.MODEL_TYPE)  # 在Config.MODEL_TYPE中选择模型
     model = model.to(Config.DEVICE)
 
+    # 训练加速：前向传播使用编译后的模型，保存和加载检查点始终使用原模型，保证fp32代码路径可直接加载
+    run_model = compile_model(model, logger)
+    scaler = create_grad_scaler()
+    logger.info(f"AMP: {Config.USE_AMP}, torch.compile: {run_model is not model}")
+
     # 定义损失函数和优化器
     criterion = nn.CrossEntropyLoss()
     optimizer = optim.Adam(model.parameters(), lr=Config.LEARNING_RATE, weight_decay=Config.WEIGHT_DECAY)
@@ -109,19 +196,22 @@ def train():
         train_correct = 0
         train_total = 0
 
+        epoch_start_time = time.time()
         train_pbar = tqdm(data_loaders['train'], desc=f"Epoch {epoch + 1}/{Config.NUM_EPOCHS} [Train]")
         for inputs, labels in train_pbar:
             inputs = inputs.to(Config.DEVICE)
             labels = labels.to(Config.DEVICE)
 
             # 前向传播
-            outputs = model(inputs)
-            loss = criterion(outputs, labels)
+            with get_autocast_context():
+                outputs = run_model(inputs)
+                loss = criterion(outputs, labels)
 
             # 反向传播和优化
             optimizer.zero_grad()
-            loss.backward()
-            optimizer.step()
+            scaler.scale(loss).backward()
+            scaler.step(optimizer)
+            scaler.update()
 
             # 更新统计信息
             train_loss += loss.item() * inputs.size(0)
@@ -135,6 +225,7 @@ def train():
         # 计算训练集平均损失和准确率
         train_loss = train_loss / len(data_loaders['train'].dataset)
         train_acc = train_correct / train_total
+        train_throughput = train_total / (time.time() - epoch_start_time)
 
         # 验证阶段
         model.eval()
@@ -142,6 +233,7 @@ def train():
         val_correct = 0
         val_total = 0
 
+        val_start_time = time.time()
         val_pbar = tqdm(data_loaders['val'], desc=f"Epoch {epoch + 1}/{Config.NUM_EPOCHS} [Val]")
         with torch.no_grad():
             for inputs, labels in val_pbar:
@@ -149,8 +241,9 @@ def train():
                 labels = labels.to(Config.DEVICE)
 
                 # 前向传播
-                outputs = model(inputs)
-                loss = criterion(outputs, labels)
+                with get_autocast_context():
+                    outputs = run_model(inputs)
+                    loss = criterion(outputs, labels)
 
                 # 更新统计信息
                 val_loss += loss.item() * inputs.size(0)
@@ -164,6 +257,7 @@ def train():
         # 计算验证集平均损失和准确率
         val_loss = val_loss / len(data_loaders['val'].dataset)
         val_acc = val_correct / val_total
+        val_throughput = val_total / (time.time() - val_start_time)
 
         # 更新学习率
         scheduler.step(val_loss)
@@ -178,6 +272,7 @@ def train():
         logger.info(f"Epoch {epoch + 1}/{Config.NUM_EPOCHS}")
         logger.info(f"Train Loss: {train_loss:.4f}, Train Acc: {train_acc:.4f}")
         logger.info(f"Val Loss: {val_loss:.4f}, Val Acc: {val_acc:.4f}")
+        logger.info(f"Throughput: train {train_throughput:.1f} samples/s, val {val_throughput:.1f} samples/s")
 
         # 早停检查
         early_stopping(val_loss, model)
@@ -209,8 +304,10 @@ def train():
             labels = labels.to(Config.DEVICE)
 
             # 前向传播
-            outputs = model(inputs)
-            loss = criterion(outputs, labels)
+            with get_autocast_context():
+                outputs = run_model(inputs)
+                loss = criterion(outputs, labels)
+            outputs = outputs.float()
 
             # 更新统计信息
             test_loss += loss.item() * inputs.size(0)
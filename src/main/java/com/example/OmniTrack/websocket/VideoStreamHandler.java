@@ -31,7 +31,11 @@ public class VideoStreamHandler extends AbstractWebSocketHandler {
             return;
         }
         System.out.println("Received binary message of size: " + message.getPayloadLength() + " bytes");
-        String result = classifyFrame(message.getPayload().array());
+        String result = classifyFrame(session.getId(), message.getPayload().array());
+        if (result == null) {
+            // 该帧被限速丢弃且还没有结果 (204)，不向前端发送
+            return;
+        }
 
         try {
             session.sendMessage(new TextMessage("CLIP Analysis: " + result));
@@ -50,7 +54,7 @@ public class VideoStreamHandler extends AbstractWebSocketHandler {
             System.out.println("Received text message: " + payload);
         }
     }
-    private String classifyFrame(byte[] frameData) {
+    private String classifyFrame(String streamId, byte[] frameData) {
         try {
             RestTemplate restTemplate = new RestTemplate();
             HttpHeaders headers = new HttpHeaders();
@@ -62,6 +66,7 @@ public class VideoStreamHandler extends AbstractWebSocketHandler {
                     return "frame.jpg";
                 }
             });
+            body.add("stream_id", streamId);
             HttpEntity<MultiValueMap<String, Object>> requestEntity = new HttpEntity<>(body, headers);
             ResponseEntity<String> response = restTemplate.exchange(CLIP_API_URL, HttpMethod.POST, requestEntity, String.class);
 